@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.dockerfile_parser import parse_dockerfile_images  # noqa: E402
+
+CORPUS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dockerfile_corpus')
+
+
+def legacy_parse_dockerfile(content):
+    images = []
+    for line in content.splitlines():
+        if line.startswith('FROM'):
+            images.append(line.split()[1])
+    return images
+
+
+def check_corpus():
+    # Each corpus file is a Dockerfile; expected.json lists the images it must produce.
+    with open(os.path.join(CORPUS_DIRECTORY, 'expected.json'), 'r', encoding='utf-8') as file:
+        expected = json.load(file)
+
+    failures = 0
+    for name, images in expected.items():
+        with open(os.path.join(CORPUS_DIRECTORY, name), 'r', encoding='utf-8') as file:
+            found = parse_dockerfile_images(file.read())
+        if found != images:
+            failures += 1
+            print(f"{name}: expected {images}, got {found}")
+    print(f"corpus: {len(expected) - failures} of {len(expected)} files parsed as expected")
+    return failures == 0
+
+
+def generate_dockerfile(index, stages):
+    lines = ['# syntax=docker/dockerfile:1', f"ARG BASE=python:3.{index % 13}-slim", 'ARG NODE=20']
+    for stage in range(stages):
+        lines.append(f"FROM --platform=$BUILDPLATFORM node:${{NODE}}-alpine AS stage{stage}")
+        lines.append('RUN apt-get update && \\')
+        lines.append('    apt-get install -y --no-install-recommends curl ca-certificates && \\')
+        lines.append('    rm -rf /var/lib/apt/lists/*')
+        lines.append(f"COPY --from=busybox:1.{stage} /bin/busybox /bin/")
+        lines.extend(f"ENV VAR_{stage}_{line}=value" for line in range(10))
+    lines.append('FROM ${BASE}')
+    lines.extend(f"COPY --from=stage{stage} /out /app/{stage}" for stage in range(stages))
+    return '\n'.join(lines) + '\n'
+
+
+def bench(parse, dockerfiles, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for content in dockerfiles:
+            parse(content)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dockerfile parser benchmark")
+    parser.add_argument("--files", type=int, default=2000, help="Synthetic Dockerfiles to parse")
+    parser.add_argument("--stages", type=int, default=4, help="Build stages per synthetic Dockerfile")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the synthetic set")
+    args = parser.parse_args()
+
+    corpus_ok = check_corpus()
+
+    dockerfiles = [generate_dockerfile(index, args.stages) for index in range(args.files)]
+    size = sum(len(content) for content in dockerfiles) * args.repeat
+    legacy = bench(legacy_parse_dockerfile, dockerfiles, args.repeat)
+    tokenizer = bench(parse_dockerfile_images, dockerfiles, args.repeat)
+
+    print(f"dockerfiles: {args.files} x {args.repeat}, {size / 1024 / 1024:.1f} MB")
+    print(f"legacy FROM scan:  {legacy:.4f}s ({size / 1024 / 1024 / legacy:.1f} MB/s)")
+    print(f"tokenizer:         {tokenizer:.4f}s ({size / 1024 / 1024 / tokenizer:.1f} MB/s)")
+    print(f"legacy images per file:    {legacy_parse_dockerfile(dockerfiles[0])}")
+    print(f"tokenizer images per file: {parse_dockerfile_images(dockerfiles[0])}")
+
+    sys.exit(0 if corpus_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
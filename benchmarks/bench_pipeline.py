@@ -0,0 +1,210 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIRECTORY))
+
+from src.docker_image_extractor import get_all_images_with_tags, TREE_SCAN_MODE  # noqa: E402
+from src.docker_image_loader import save_docker_images  # noqa: E402
+from src.yandex_disk_uploader import upload_to_yandex_disk  # noqa: E402
+from src.yandex_disk_client import YandexDiskClient  # noqa: E402
+from src.parse_cache import ParseCache  # noqa: E402
+from src.scan_state import ScanState  # noqa: E402
+from src.metrics import metrics  # noqa: E402
+from fake_yandex_disk import FakeYandexDisk  # noqa: E402
+from fake_docker import IMAGE_SIZE_VARIABLE  # noqa: E402
+
+RESULT_VERSION = 1
+GIT_ENVIRONMENT = {
+    'GIT_AUTHOR_NAME': 'bench', 'GIT_AUTHOR_EMAIL': 'bench@example.com',
+    'GIT_COMMITTER_NAME': 'bench', 'GIT_COMMITTER_EMAIL': 'bench@example.com',
+}
+
+
+def git(repo_path, *args):
+    subprocess.run(["git", *args], cwd=repo_path, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   env={**os.environ, **GIT_ENVIRONMENT})
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(content)
+
+
+def generate_dockerfile(repo, service, branch):
+    return (f"ARG BASE=python:3.{service % 13}-slim\n"
+            f"FROM --platform=$BUILDPLATFORM golang:1.{20 + service % 3} AS build\n"
+            "RUN go build ./... \\\n    && echo done\n"
+            "FROM ${BASE}\n"
+            f"COPY --from=bench/tools-{repo}:{branch}.{service} /bin/tool /bin/\n")
+
+
+def generate_compose(repo, index, services):
+    lines = ["services:"]
+    for service in range(services):
+        lines.append(f"  svc{service}:\n    image: bench/compose-{repo}-{index}-{service}:1.{service}")
+    return '\n'.join(lines) + '\n'
+
+
+def generate_workflow(repo, index, matrix_size):
+    values = ', '.join(str(value) for value in range(matrix_size))
+    return (f"name: ci-{index}\n"
+            "on: [push]\n"
+            "env:\n  REGISTRY: ghcr.io\n"
+            "jobs:\n"
+            "  test:\n"
+            "    runs-on: ubuntu-latest\n"
+            "    strategy:\n"
+            f"      matrix:\n        version: [{values}]\n        variant: [{values}]\n        os: [linux, windows]\n"
+            f"    container:\n      image: ${{{{ env.REGISTRY }}}}/bench-{repo}-{index}:${{{{ matrix.version }}}}"
+            "-${{ matrix.variant }}\n"
+            "    steps:\n      - run: make test\n")
+
+
+def generate_repository(repo_path, repo, args):
+    os.makedirs(repo_path)
+    git(repo_path, 'init', '-q', '-b', 'main')
+    for service in range(args.dockerfiles):
+        write_file(os.path.join(repo_path, 'services', f"s{service}", 'Dockerfile'),
+                   generate_dockerfile(repo, service, 0))
+    for index in range(args.compose_files):
+        write_file(os.path.join(repo_path, 'deploy', f"c{index}", 'docker-compose.yml'),
+                   generate_compose(repo, index, args.compose_services))
+    for index in range(args.workflows):
+        write_file(os.path.join(repo_path, '.github', 'workflows', f"ci{index}.yml"),
+                   generate_workflow(repo, index, args.matrix_size))
+    git(repo_path, 'add', '-A')
+    git(repo_path, 'commit', '-q', '-m', 'initial')
+
+    # Every branch changes one Dockerfile, so most blobs are shared between branches as in real repositories.
+    for branch in range(1, args.branches):
+        git(repo_path, 'checkout', '-q', '-b', f"branch-{branch}", 'main')
+        service = branch % max(1, args.dockerfiles)
+        write_file(os.path.join(repo_path, 'services', f"s{service}", 'Dockerfile'),
+                   generate_dockerfile(repo, service, branch))
+        git(repo_path, 'commit', '-q', '-am', f"branch {branch}")
+    git(repo_path, 'checkout', '-q', 'main')
+
+
+def install_fake_docker(directory):
+    bin_directory = os.path.join(directory, 'bin')
+    os.makedirs(bin_directory)
+    script = os.path.join(bin_directory, 'docker')
+    write_file(script, f"#!/bin/sh\nexec \"{sys.executable}\" \"{os.path.join(BENCHMARKS_DIRECTORY, 'fake_docker.py')}\" "
+                       "\"$@\"\n")
+    os.chmod(script, 0o755)
+    return bin_directory
+
+
+def run_stage(results, name, verbose, function, *args):
+    # Each stage gets its own metrics so that a regression can be traced to the step that caused it.
+    metrics.reset()
+    output = None if verbose else io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output) if output is not None else contextlib.nullcontext():
+        value = function(*args)
+    seconds = time.perf_counter() - started
+    results[name] = {'seconds': seconds, **metrics.snapshot()}
+    print(f"{name:<12} {seconds:8.3f}s", file=sys.stderr)
+    return value
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARKS_DIRECTORY, check=True, text=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline scan, save and upload benchmark")
+    parser.add_argument("--repos", type=int, default=4, help="Synthetic git repositories")
+    parser.add_argument("--branches", type=int, default=10, help="Branches per repository")
+    parser.add_argument("--dockerfiles", type=int, default=10, help="Dockerfiles per repository")
+    parser.add_argument("--compose_files", type=int, default=3, help="docker-compose.yml files per repository")
+    parser.add_argument("--compose_services", type=int, default=5, help="Services per compose file")
+    parser.add_argument("--workflows", type=int, default=3, help="GitHub Actions workflows per repository")
+    parser.add_argument("--matrix_size", type=int, default=8, help="Values per matrix dimension in workflows")
+    parser.add_argument("--jobs", type=int, default=1, help="Scan worker processes")
+    parser.add_argument("--images", type=int, default=12, help="Images to save and upload")
+    parser.add_argument("--image_size", type=int, default=8 * 1024 * 1024, help="Bytes per fake image")
+    parser.add_argument("--pull_jobs", type=int, default=4, help="Concurrent pulls")
+    parser.add_argument("--save_jobs", type=int, default=2, help="Concurrent saves")
+    parser.add_argument("--upload_jobs", type=int, default=4, help="Concurrent uploads")
+    parser.add_argument("--output", help="Write the JSON result to this file instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated working directory")
+    parser.add_argument("--verbose", action="store_true", help="Show the collector output")
+    args = parser.parse_args()
+
+    work_directory = tempfile.mkdtemp(prefix='docker_images_collector_bench_')
+    repositories_directory = os.path.join(work_directory, 'repositories')
+    save_directory = os.path.join(work_directory, 'images')
+    results = {}
+
+    # The collector finds the fake docker on PATH; a non-unix DOCKER_HOST keeps it off a real Engine socket.
+    os.environ['PATH'] = install_fake_docker(work_directory) + os.pathsep + os.environ.get('PATH', '')
+    os.environ['DOCKER_HOST'] = 'tcp://127.0.0.1:1'
+    os.environ[IMAGE_SIZE_VARIABLE] = str(args.image_size)
+
+    disk = FakeYandexDisk().start()
+    try:
+        started = time.perf_counter()
+        for repo in range(args.repos):
+            generate_repository(os.path.join(repositories_directory, f"repo{repo}"), repo, args)
+        results['generate'] = {'seconds': time.perf_counter() - started}
+        print(f"{'generate':<12} {results['generate']['seconds']:8.3f}s", file=sys.stderr)
+
+        parse_cache, scan_state = ParseCache(), ScanState()
+        images = run_stage(results, 'scan_cold', args.verbose, get_all_images_with_tags, repositories_directory,
+                           TREE_SCAN_MODE, parse_cache, scan_state, args.jobs)
+        run_stage(results, 'scan_warm', args.verbose, get_all_images_with_tags, repositories_directory,
+                  TREE_SCAN_MODE, parse_cache, scan_state, args.jobs)
+        results['scan_cold']['images'] = len(images)
+
+        selected = sorted(images)[:args.images]
+        run_stage(results, 'save', args.verbose, save_docker_images, selected, save_directory, args.pull_jobs,
+                  args.save_jobs, 0)
+
+        client = YandexDiskClient('benchmark-token', base_url=disk.api_url, pool_size=args.upload_jobs)
+        run_stage(results, 'upload_cold', args.verbose, upload_to_yandex_disk, save_directory, client, '/bench',
+                  args.upload_jobs)
+        results['upload_cold']['uploaded_bytes'] = disk.uploaded_bytes
+        run_stage(results, 'upload_warm', args.verbose, upload_to_yandex_disk, save_directory, client, '/bench',
+                  args.upload_jobs)
+        client.close()
+    finally:
+        disk.stop()
+        if args.keep:
+            print(f"Working directory kept at {work_directory}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    report = {
+        'version': RESULT_VERSION,
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'stages': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import re
+import sys
+import time
+import argparse
+import itertools
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.docker_image_extractor import extract_variables, parse_github_actions_content  # noqa: E402
+from src.yaml_loader import YAML_LOADER  # noqa: E402
+
+
+def legacy_replace_variables(value, variables):
+    pattern = re.compile(r'\$\{\{\s*(.*?)\s*\}\}')
+
+    def replacer(match):
+        var_name = match.group(1)
+        for var_key, var_value in variables.items():
+            if var_key.endswith(var_name):
+                return str(var_value)
+        return match.group(0)
+
+    return pattern.sub(replacer, value)
+
+
+def generate_workflow(jobs, env_per_job):
+    return {
+        'env': {'REGISTRY': 'ghcr.io'},
+        'jobs': {
+            f"job_{job}": {
+                'env': {f"VAR_{job}_{index}": f"value_{index}" for index in range(env_per_job)},
+                'strategy': {'matrix': {'node': [16, 18, 20], 'os': ['ubuntu', 'windows']}},
+                'container': {'image': f"${{{{ env.REGISTRY }}}}/app-{job}:${{{{ env.VAR_{job}_0 }}}}"
+                                       f"-${{{{ matrix.node }}}}-${{{{ matrix.os }}}}"},
+            }
+            for job in range(jobs)
+        },
+    }
+
+
+def legacy_parse_workflow(content):
+    # The old substitution, given the benefit of expanding each job's own matrix only: the original
+    # product over every list in the document does not finish on a workflow of this size.
+    workflow = yaml.load(content, Loader=YAML_LOADER)
+    variables = extract_variables(workflow)
+    images = []
+    jobs = workflow['jobs']
+    for job in jobs.values():
+        matrix = job['strategy']['matrix']
+        for values in itertools.product(*matrix.values()):
+            # As in the old generate_combinations, a combination replaces every matrix list under its full
+            # key; the suffix lookup would otherwise hit the first job's list. All jobs share one matrix.
+            combination = {f"jobs.{name}.strategy.matrix.{key}": value
+                           for name in jobs for key, value in zip(matrix, values)}
+            images.append(legacy_replace_variables(job['container']['image'], {**variables, **combination}))
+    return images
+
+
+def bench(parse, content, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        images = parse(content)
+    return time.perf_counter() - started, images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Variable substitution micro-benchmark")
+    parser.add_argument("--jobs", type=int, default=200, help="Jobs in the synthetic workflow")
+    parser.add_argument("--env_per_job", type=int, default=20, help="Environment variables per job")
+    parser.add_argument("--repeat", type=int, default=3, help="Parses of the workflow")
+    args = parser.parse_args()
+
+    # Both sides load the same workflow text; the new side is the function the scanner calls.
+    workflow = generate_workflow(args.jobs, args.env_per_job)
+    content = yaml.safe_dump(workflow)
+    legacy, legacy_images = bench(legacy_parse_workflow, content, args.repeat)
+    indexed, indexed_images = bench(lambda text: parse_github_actions_content(text, 'bench.yml'), content,
+                                    args.repeat)
+
+    print(f"variables: {len(extract_variables(workflow))}, jobs: {args.jobs}, images: {len(indexed_images)}, "
+          f"repeat: {args.repeat}")
+    print(f"legacy replace_variables:     {legacy:.4f}s")
+    print(f"parse_github_actions_content: {indexed:.4f}s ({legacy / indexed:.1f}x)")
+
+    if sorted(legacy_images) != sorted(indexed_images):
+        print("images differ between the legacy and the current substitution")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
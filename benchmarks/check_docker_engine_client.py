@@ -0,0 +1,133 @@
+import io
+import os
+import sys
+import json
+import base64
+import shutil
+import tarfile
+import tempfile
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIRECTORY))
+
+from src.docker_engine_client import DockerEngineClient, get_registry_auth, DOCKER_HUB_AUTH_KEY  # noqa: E402
+from src.exception import DockerEngineError  # noqa: E402
+from fake_docker_engine import FakeDockerEngine, image_id  # noqa: E402
+
+# Runs DockerEngineClient against the stand-in Engine API server in fake_docker_engine.py.
+# Every check prints its result; the script exits with a non-zero code if any of them failed.
+
+
+def check_ping_and_listing(engine, client):
+    assert client.ping()
+    assert client.list_images() == engine.images
+    assert client.image_exists('alpine:3.19')
+    assert not client.image_exists('missing:1')
+    assert client.inspect_image('alpine:3.19')['Id'] == image_id('alpine:3.19')
+
+
+def check_pull(engine, client):
+    progress = []
+    client.pull_image('nginx:1.25', progress.append)
+    assert 'nginx:1.25' in engine.images
+    assert progress and all('status' in message for message in progress)
+
+    # The daemon answers 200 and reports the failure in the JSON stream.
+    engine.pull_errors['private/app:1'] = 'pull access denied for private/app, repository does not exist'
+    try:
+        client.pull_image('private/app:1')
+    except DockerEngineError as e:
+        assert 'pull access denied' in str(e)
+    else:
+        raise AssertionError('pull error inside a 200 response was not raised')
+    assert 'private/app:1' not in engine.images
+
+    # The connection is still usable after the chunked response was read to the end.
+    assert client.ping()
+
+
+def check_reconnect(engine, client):
+    # Every ping after the first finds its kept-alive connection closed by the server and has to reconnect.
+    client.close()
+    engine.drop_idle = True
+    try:
+        connections = engine.connections
+        for _ in range(3):
+            assert client.ping()
+        assert engine.connections - connections == 3
+    finally:
+        engine.drop_idle = False
+    client.close()
+
+
+def check_export(engine, client):
+    data = b''.join(client.export_images(['alpine:3.19']))
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        manifest = json.load(tar.extractfile('manifest.json'))
+    assert manifest[0]['RepoTags'] == ['alpine:3.19']
+
+    # Closing the generator in the middle of the body drops the connection instead of reusing it.
+    chunks = client.export_images(['alpine:3.19'], chunk_size=1024)
+    next(chunks)
+    connection = client._get_connection()
+    chunks.close()
+    assert client._get_connection() is not connection
+    assert client.ping()
+
+
+def check_registry_auth(engine, client):
+    config_directory = tempfile.mkdtemp(prefix='docker_config_')
+    previous = os.environ.get('DOCKER_CONFIG')
+    try:
+        auth = base64.b64encode(b'robot:secret').decode()
+        with open(os.path.join(config_directory, 'config.json'), 'w', encoding='utf-8') as file:
+            json.dump({'auths': {'registry.example.com:5000': {'auth': auth},
+                                 DOCKER_HUB_AUTH_KEY: {'identitytoken': 'hub-token'}}}, file)
+        os.environ['DOCKER_CONFIG'] = config_directory
+
+        assert get_registry_auth('docker.io') == {'identitytoken': 'hub-token', 'serveraddress': DOCKER_HUB_AUTH_KEY}
+        assert get_registry_auth('ghcr.io') is None
+
+        client.pull_image('registry.example.com:5000/team/app:2')
+        _, path, headers = engine.requests[-1]
+        assert path.startswith('/images/create?fromImage=registry.example.com%3A5000%2Fteam%2Fapp&tag=2')
+        header = json.loads(base64.urlsafe_b64decode(headers['X-Registry-Auth']))
+        assert header == {'username': 'robot', 'password': 'secret', 'serveraddress': 'registry.example.com:5000'}
+
+        client.pull_image('ghcr.io/acme/tools:1')
+        assert 'X-Registry-Auth' not in engine.requests[-1][2]
+    finally:
+        if previous is None:
+            os.environ.pop('DOCKER_CONFIG', None)
+        else:
+            os.environ['DOCKER_CONFIG'] = previous
+        shutil.rmtree(config_directory, ignore_errors=True)
+
+
+CHECKS = [check_ping_and_listing, check_pull, check_reconnect, check_export, check_registry_auth]
+
+
+def main():
+    work_directory = tempfile.mkdtemp(prefix='docker_engine_check_')
+    engine = FakeDockerEngine(os.path.join(work_directory, 'docker.sock'), images={'alpine:3.19'}).start()
+    client = DockerEngineClient(engine.socket_path, timeout=10)
+    failures = 0
+    try:
+        for check in CHECKS:
+            try:
+                check(engine, client)
+                print(f"{check.__name__}: ok")
+            except Exception as e:
+                failures += 1
+                print(f"{check.__name__}: FAILED {type(e).__name__}: {e}")
+    finally:
+        client.close()
+        engine.stop()
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    print(f"{len(CHECKS) - failures} of {len(CHECKS)} checks passed")
+    sys.exit(0 if failures == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
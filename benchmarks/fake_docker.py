@@ -0,0 +1,76 @@
+import io
+import os
+import sys
+import json
+import hashlib
+import tarfile
+
+# Stand-in for the docker CLI: every image exists locally and `docker save` emits a docker-save style
+# tar with one layer shared by all images and one layer unique to the image.
+IMAGE_SIZE_VARIABLE = 'FAKE_DOCKER_IMAGE_SIZE'
+DEFAULT_IMAGE_SIZE = 4 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+
+class PatternReader(io.RawIOBase):
+    def __init__(self, seed, size):
+        block = hashlib.sha256(seed.encode()).digest()
+        self._block = (block * (BLOCK_SIZE // len(block) + 1))[:BLOCK_SIZE]
+        self._remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining, BLOCK_SIZE)
+        buffer[:size] = self._block[:size]
+        self._remaining -= size
+        return size
+
+
+def add_member(tar, name, size, reader):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = 0
+    tar.addfile(info, reader)
+
+
+def write_image(image, output, image_size):
+    base_size = image_size // 2
+    unique_size = image_size - base_size
+    image_id = hashlib.sha256(image.encode()).hexdigest()
+    config = json.dumps({'architecture': 'amd64', 'os': 'linux', 'image': image}).encode()
+    manifest = json.dumps([{
+        'Config': f"{image_id}.json",
+        'RepoTags': [image],
+        'Layers': ['base/layer.tar', f"{image_id}/layer.tar"],
+    }]).encode()
+
+    with tarfile.open(fileobj=output, mode='w|') as tar:
+        add_member(tar, 'base/layer.tar', base_size, io.BufferedReader(PatternReader('base', base_size)))
+        add_member(tar, f"{image_id}/layer.tar", unique_size, io.BufferedReader(PatternReader(image, unique_size)))
+        add_member(tar, f"{image_id}.json", len(config), io.BytesIO(config))
+        add_member(tar, 'manifest.json', len(manifest), io.BytesIO(manifest))
+
+
+def main(args):
+    command = args[0] if args else ''
+    image_size = int(os.environ.get(IMAGE_SIZE_VARIABLE, DEFAULT_IMAGE_SIZE))
+
+    if command == 'inspect':
+        if args[1] == '--format':
+            print(f"sha256:{hashlib.sha256(args[3].encode()).hexdigest()}")
+        return 0
+    if command == 'save':
+        if args[1] == '-o':
+            with open(args[2], 'wb') as file:
+                write_image(args[3], file, image_size)
+        else:
+            write_image(args[1], sys.stdout.buffer, image_size)
+        return 0
+    # ps, images, pull and the rest succeed without output.
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,156 @@
+import sys
+import json
+import hashlib
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from fake_docker import write_image
+
+# Local emulation of the Docker Engine API calls the client makes, served on a unix socket:
+# _ping, images/json, images/<name>/json, images/create (JSON progress lines, chunked) and images/get.
+# Images listed in pull_errors fail after the pull started, inside a 200 response, as the daemon does it.
+# With drop_idle set, the server closes every connection after one response without announcing it,
+# like a daemon timing out an idle keep-alive connection.
+
+
+class ChunkedWriter:
+    def __init__(self, wfile):
+        self._wfile = wfile
+
+    def write(self, data):
+        if data:
+            self._wfile.write(f"{len(data):x}\r\n".encode() + bytes(data) + b"\r\n")
+        return len(data)
+
+    def close(self):
+        self._wfile.write(b"0\r\n\r\n")
+
+
+class FakeDockerEngineHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_one_request(self):
+        super().handle_one_request()
+        if self.server.engine.drop_idle:
+            self.close_connection = True
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        return ChunkedWriter(self.wfile)
+
+    def do_GET(self):
+        engine = self.server.engine
+        engine.record(self)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == '/_ping':
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'OK')
+        elif url.path == '/images/json':
+            self.send_json(200, [{'Id': image_id(image), 'RepoTags': [image], 'RepoDigests': []}
+                                 for image in sorted(engine.images)])
+        elif url.path.startswith('/images/') and url.path.endswith('/json'):
+            image = unquote(url.path[len('/images/'):-len('/json')])
+            if image in engine.images:
+                self.send_json(200, {'Id': image_id(image), 'RepoTags': [image]})
+            else:
+                self.send_json(404, {'message': f"No such image: {image}"})
+        elif url.path == '/images/get':
+            writer = self.start_chunked('application/x-tar')
+            for image in params.get('names', []):
+                write_image(image, writer, engine.image_size)
+            writer.close()
+        else:
+            self.send_json(404, {'message': 'page not found'})
+
+    def do_POST(self):
+        engine = self.server.engine
+        engine.record(self)
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path != '/images/create':
+            self.send_json(404, {'message': 'page not found'})
+            return
+
+        image = f"{params['fromImage']}:{params.get('tag', 'latest')}"
+        writer = self.start_chunked('application/json')
+        writer.write(json.dumps({'status': f"Pulling from {params['fromImage']}", 'id': params.get('tag')}).encode()
+                     + b'\r\n')
+        if image in engine.pull_errors:
+            writer.write(json.dumps({'errorDetail': {'message': engine.pull_errors[image]},
+                                     'error': engine.pull_errors[image]}).encode() + b'\r\n')
+        else:
+            engine.images.add(image)
+            writer.write(json.dumps({'status': f"Downloaded newer image for {image}"}).encode() + b'\r\n')
+        writer.close()
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) client address, which unix sockets do not have.
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+    def handle_error(self, request, client_address):
+        # Clients hang up in the middle of an export on purpose; only unexpected errors are printed.
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def image_id(image):
+    return f"sha256:{hashlib.sha256(image.encode()).hexdigest()}"
+
+
+class FakeDockerEngine:
+    def __init__(self, socket_path, images=(), image_size=64 * 1024):
+        self.socket_path = socket_path
+        self.images = set(images)
+        self.image_size = image_size
+        self.pull_errors = {}
+        self.drop_idle = False
+        self.requests = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingUnixHTTPServer(socket_path, FakeDockerEngineHandler)
+        self._server.engine = self
+        self._thread = None
+
+    def record(self, handler):
+        with self._lock:
+            self.requests.append((handler.command, handler.path, dict(handler.headers)))
+
+    def start(self):
+        handle = self._server.finish_request
+
+        def finish_request(request, client_address):
+            with self._lock:
+                self.connections += 1
+            handle(request, client_address)
+
+        self._server.finish_request = finish_request
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
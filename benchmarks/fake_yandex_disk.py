@@ -0,0 +1,145 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Local emulation of the Yandex.Disk REST API calls the uploader makes: resources (list, create),
+# resources/download, resources/upload (href flow), resources/move and the token check.
+# Large uploads are only counted; small files (manifests, .hash files) are kept so they can be read back.
+KEEP_CONTENT_LIMIT = 1024 * 1024
+API_PATH = '/v1/disk'
+
+
+class FakeYandexDiskHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body=None):
+        data = json.dumps(body or {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def parse_request_url(self):
+        url = urlparse(self.path)
+        return url.path, {key: values[0] for key, values in parse_qs(url.query).items()}
+
+    def read_body(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    def do_GET(self):
+        disk = self.server.disk
+        path, params = self.parse_request_url()
+        if path == API_PATH:
+            self.send_json(200, {'total_space': 0})
+        elif path == f"{API_PATH}/resources":
+            items = disk.list(params['path'])
+            offset, limit = int(params.get('offset', 0)), int(params.get('limit', 20))
+            self.send_json(200, {'_embedded': {'items': items[offset:offset + limit], 'total': len(items)}})
+        elif path == f"{API_PATH}/resources/download":
+            if params['path'] not in disk.files:
+                self.send_json(404, {'error': 'DiskNotFoundError'})
+            else:
+                self.send_json(200, {'href': f"{disk.url}/download?path={params['path']}"})
+        elif path == f"{API_PATH}/resources/upload":
+            self.send_json(200, {'href': f"{disk.url}/upload?path={params['path']}"})
+        elif path == '/download':
+            data = disk.files.get(params['path']) or b''
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_json(404)
+
+    def do_PUT(self):
+        disk = self.server.disk
+        path, params = self.parse_request_url()
+        if path == f"{API_PATH}/resources":
+            self.send_json(201)
+        elif path == '/upload':
+            size = 0
+            kept = []
+            for chunk in self.read_body():
+                size += len(chunk)
+                if size <= KEEP_CONTENT_LIMIT:
+                    kept.append(chunk)
+            disk.store(params['path'], b''.join(kept) if size <= KEEP_CONTENT_LIMIT else None, size)
+            self.send_json(201)
+        else:
+            self.send_json(404)
+
+    def do_POST(self):
+        disk = self.server.disk
+        path, params = self.parse_request_url()
+        if path == f"{API_PATH}/resources/move" and params['from'] in disk.files:
+            disk.move(params['from'], params['path'])
+            self.send_json(201)
+        else:
+            self.send_json(404)
+
+
+class FakeYandexDisk:
+    def __init__(self, host='127.0.0.1', port=0):
+        self.files = {}
+        self.sizes = {}
+        self.uploaded_bytes = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), FakeYandexDiskHandler)
+        self._server.daemon_threads = True
+        self._server.disk = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self):
+        return f"{self.url}{API_PATH}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def store(self, path, data, size):
+        with self._lock:
+            self.files[path] = data
+            self.sizes[path] = size
+            self.uploaded_bytes += size
+
+    def move(self, from_path, to_path):
+        with self._lock:
+            self.files[to_path] = self.files.pop(from_path)
+            self.sizes[to_path] = self.sizes.pop(from_path)
+
+    def list(self, directory):
+        prefix = directory.rstrip('/') + '/'
+        with self._lock:
+            names = sorted({path[len(prefix):].split('/', 1)[0] for path in self.files if path.startswith(prefix)})
+        return [{'name': name, 'path': prefix + name} for name in names]
@@ -1,10 +1,23 @@
 import argparse
+import os
 import subprocess
-import requests
 import platform
-from src.docker_image_extractor import get_all_images_with_tags, get_remote_repo_images_with_tags
-from src.docker_image_loader import save_docker_images, is_docker_running
-from src.yandex_disk_uploader import upload_to_yandex_disk
+from src.docker_image_extractor import get_all_images_with_tags, get_remote_repo_images_with_tags, SCAN_MODES, \
+    TREE_SCAN_MODE
+from src.parse_cache import ParseCache
+from src.scan_state import ScanState, SCAN_STATE_FILE_NAME
+from src.image_catalog import ImageCatalog, CATALOG_FILE_NAME
+from src.repo_mirror import DEFAULT_MIRROR_DIRECTORY, DEFAULT_CLONE_JOBS, redact_url
+from src.docker_image_loader import save_docker_images, is_docker_running, DEFAULT_PULL_JOBS, DEFAULT_SAVE_JOBS, \
+    DEFAULT_PULL_RETRIES, EXPORT_MODES, ARCHIVE_EXPORT_MODE
+from src.docker_engine_client import get_docker_client
+from src.yandex_disk_uploader import upload_to_yandex_disk, upload_image_stream, RemoteManifest
+from src.yandex_disk_client import YandexDiskClient, DEFAULT_UPLOAD_JOBS, DEFAULT_UPLOAD_RETRIES
+from src.exception import YandexDiskError
+from src.pipeline import run_pipeline, ImagePipeline, DEFAULT_QUEUE_SIZE
+from src.watch import run_watch, DEFAULT_POLL_INTERVAL
+from src.metrics import metrics, run_profiled, PROFILERS, PYINSTRUMENT_PROFILER, pyinstrument
+from src.image_stream import COMPRESSIONS, NO_COMPRESSION, ZSTD_COMPRESSION, zstandard
 
 
 def is_docker_installed():
@@ -18,29 +31,135 @@ def is_docker_installed():
         return False
 
 
-def check_yandex_disk_token(token):
-    url = "https://cloud-api.yandex.net/v1/disk"
-    headers = {"Authorization": f"OAuth {token}"}
-    response = requests.get(url, headers=headers)
-    return response.status_code == 200
-
-
 def main():
     parser = argparse.ArgumentParser(description="Docker Images Collector")
-    parser.add_argument("--function", choices=["local", "remote"], required=True, help="Function to execute")
+    parser.add_argument("--function", choices=["local", "remote", "catalog", "query"], required=True,
+                        help="Function to execute: scan local or remote repositories, save and upload the images "
+                             "recorded in the catalog without scanning, or query the catalog")
     parser.add_argument("--base_path", help="Base path for local repositories")
     parser.add_argument("--repo_urls", help="Comma-separated list of remote repository URLs")
-    parser.add_argument("--save_directory", required=True, help="Directory to save Docker images")
+    parser.add_argument("--save_directory", required=False, help="Directory to save Docker images")
     parser.add_argument("--yandex_disk_directory", required=False, help="Directory on Yandex Disk to upload files")
     parser.add_argument("--yandex_disk_token", required=False, help="Token for Yandex Disk")
+    parser.add_argument("--scan_mode", choices=SCAN_MODES, default=TREE_SCAN_MODE,
+                        help="Read branches from git objects (tree) or check out every branch (checkout)")
+    parser.add_argument("--parse_cache", required=False,
+                        help="JSON file that keeps parsed images per file content between runs")
+    parser.add_argument("--scan_state", required=False,
+                        help=f"JSON file with the last scanned commit of every branch "
+                             f"(default: <save_directory>/{SCAN_STATE_FILE_NAME})")
+    parser.add_argument("--full_scan", action="store_true",
+                        help="Ignore the saved scan state and rescan every branch")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of repositories scanned in parallel worker processes")
+    parser.add_argument("--ignore", default="",
+                        help="Comma-separated glob patterns of directories and files to skip when walking --base_path")
+    parser.add_argument("--use_gitignore", action="store_true",
+                        help="Skip paths ignored by .gitignore files when walking --base_path")
+    parser.add_argument("--nested_repos", action="store_true",
+                        help="Keep searching inside found repositories for nested repositories and submodules")
+    parser.add_argument("--mirror_directory", default=DEFAULT_MIRROR_DIRECTORY,
+                        help="Directory with bare partial mirrors of remote repositories")
+    parser.add_argument("--clone_jobs", type=int, default=DEFAULT_CLONE_JOBS,
+                        help="Number of remote repositories cloned or fetched concurrently")
+    parser.add_argument("--pull_jobs", type=int, default=DEFAULT_PULL_JOBS,
+                        help="Number of Docker images pulled concurrently")
+    parser.add_argument("--save_jobs", type=int, default=DEFAULT_SAVE_JOBS,
+                        help="Number of Docker images saved to tar archives concurrently")
+    parser.add_argument("--export_mode", choices=EXPORT_MODES, default=ARCHIVE_EXPORT_MODE,
+                        help="Save one tar per image (archive) or a shared content-addressed blob store (layers)")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default=NO_COMPRESSION,
+                        help="Compress image archives while they are streamed out of Docker")
+    parser.add_argument("--compression_level", type=int, required=False,
+                        help="Compression level (default: 6 for gzip, 3 for zstd)")
+    parser.add_argument("--stream_upload", action="store_true",
+                        help="Stream archives straight into the Yandex Disk upload without writing them to disk")
+    parser.add_argument("--pull_retries", type=int, default=DEFAULT_PULL_RETRIES,
+                        help="Retries with exponential backoff for transient pull failures")
+    parser.add_argument("--upload_jobs", type=int, default=DEFAULT_UPLOAD_JOBS,
+                        help="Number of files uploaded to Yandex Disk concurrently")
+    parser.add_argument("--upload_retries", type=int, default=DEFAULT_UPLOAD_RETRIES,
+                        help="Retries with exponential backoff for failed Yandex Disk uploads")
+    parser.add_argument("--resolve_ids", action="store_true",
+                        help="Save only one of several references that resolve to the same image ID")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Pull, save and upload images while repositories are still being scanned")
+    parser.add_argument("--queue_size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Capacity of each queue between pipeline stages")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running: rescan the repositories every --poll_interval seconds and pull, save "
+                             "and upload only images that were not seen before")
+    parser.add_argument("--poll_interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Seconds between the starts of two watch cycles")
+    parser.add_argument("--watch_cycles", type=int, default=0,
+                        help="Stop watch mode after this many cycles (default: run until interrupted)")
+    parser.add_argument("--delete_after_upload", action="store_true",
+                        help="Delete local archives once their upload to Yandex Disk is confirmed")
+    parser.add_argument("--catalog", required=False,
+                        help=f"SQLite catalog of the images found in every file of every branch "
+                             f"(default: <save_directory>/{CATALOG_FILE_NAME})")
+    parser.add_argument("--image", required=False,
+                        help="Image to look up with --function query; without a tag every tag matches")
+    parser.add_argument("--repository", required=False,
+                        help="Repository path or origin URL ('*' wildcards allowed) to limit --function query "
+                             "and --function catalog to")
+    parser.add_argument("--report", required=False,
+                        help="Write a JSON report with per-stage timings, bytes and cache counters to this path")
+    parser.add_argument("--profile", choices=PROFILERS, required=False,
+                        help="Run under cProfile or pyinstrument")
+    parser.add_argument("--profile_output", required=False,
+                        help="File for profiler output (pstats for cprofile, HTML for pyinstrument); "
+                             "printed to stdout if omitted")
 
     args = parser.parse_args()
 
-    if not is_docker_installed():
+    if args.profile == PYINSTRUMENT_PROFILER and pyinstrument is None:
+        parser.error("--profile pyinstrument requires the 'pyinstrument' package (pip install pyinstrument)")
+
+    images = None
+    try:
+        images = run_profiled(args.profile, args.profile_output, run, args, parser)
+    finally:
+        if args.report:
+            arguments = {key: value for key, value in vars(args).items() if key != "yandex_disk_token"}
+            if args.repo_urls:
+                arguments["repo_urls"] = ",".join(redact_url(url) for url in args.repo_urls.split(","))
+            metrics.save_report(args.report, {"arguments": arguments, "images": images})
+
+
+def query_catalog(args):
+    catalog = ImageCatalog(args.catalog)
+    rows = catalog.query(args.image, args.repository)
+    catalog.close()
+
+    for row in rows:
+        print(f"{row['image']}\t{row['origin'] or row['repository']}\t{row['branch']}\t{row['commit_sha'][:12]}\t"
+              f"{row['path']}")
+    print(f"{len(rows)} matches.")
+    return sorted({row['image'] for row in rows})
+
+
+def run(args, parser):
+    if args.function != "query" and not args.save_directory:
+        parser.error(f"--save_directory is required for {args.function} function")
+
+    if not args.catalog:
+        if not args.save_directory:
+            parser.error("--catalog or --save_directory is required for query function")
+        args.catalog = os.path.join(args.save_directory, CATALOG_FILE_NAME)
+
+    if args.function == "query":
+        if not os.path.exists(args.catalog):
+            parser.error(f"Catalog {args.catalog} does not exist. Run a local or remote scan first.")
+        return query_catalog(args)
+
+    docker_client = get_docker_client()
+
+    if docker_client is None and not is_docker_installed():
         print("Docker is not installed. Please install Docker and try again.")
         return
 
-    if not is_docker_running():
+    if not is_docker_running(docker_client):
         print("Docker daemon is not running. Please start Docker and try again.")
         return
 
@@ -50,28 +169,113 @@ def main():
     if args.function == "remote" and not args.repo_urls:
         parser.error("--repo_urls is required for remote function")
 
-    if args.function == "local":
-        images = get_all_images_with_tags(args.base_path)
-    else:
+    if args.compression == ZSTD_COMPRESSION and zstandard is None:
+        parser.error("--compression zstd requires the 'zstandard' package (pip install zstandard)")
+
+    if args.stream_upload and not (args.yandex_disk_token and args.yandex_disk_directory):
+        parser.error("--stream_upload requires --yandex_disk_token and --yandex_disk_directory")
+
+    if args.function == "remote" and args.scan_mode != TREE_SCAN_MODE:
+        parser.error("--scan_mode checkout is only supported for local repositories")
+
+    if (args.pipeline or args.watch) and (args.stream_upload or args.export_mode != ARCHIVE_EXPORT_MODE):
+        parser.error("--pipeline and --watch save one archive per image and cannot be combined with "
+                     "--stream_upload or --export_mode layers")
+
+    parse_cache = ParseCache(args.parse_cache)
+    scan_state_path = args.scan_state or os.path.join(args.save_directory, SCAN_STATE_FILE_NAME)
+    scan_state = ScanState(scan_state_path, load=not args.full_scan)
+    catalog = ImageCatalog(args.catalog)
+
+    def scan(on_images=None):
+        if args.function == "catalog":
+            # Images of the last scan are taken from the catalog, no repository is read.
+            images = catalog.list_images(args.repository)
+            if on_images is not None and images:
+                on_images(images)
+            return images
+        if args.function == "local":
+            ignore_patterns = [pattern for pattern in args.ignore.split(",") if pattern]
+            return get_all_images_with_tags(args.base_path, args.scan_mode, parse_cache, scan_state, args.jobs,
+                                            ignore_patterns, args.use_gitignore, args.nested_repos, on_images,
+                                            catalog)
         repo_urls = args.repo_urls.split(",")
-        images = get_remote_repo_images_with_tags(repo_urls)
+        return get_remote_repo_images_with_tags(repo_urls, args.scan_mode, parse_cache, scan_state, args.jobs,
+                                                args.mirror_directory, args.clone_jobs, on_images, catalog)
+
+    if args.pipeline or args.watch:
+        yandex_disk_client = None
+        if args.yandex_disk_token and args.yandex_disk_directory:
+            yandex_disk_client = YandexDiskClient(args.yandex_disk_token, pool_size=args.upload_jobs)
+            if not yandex_disk_client.check_token():
+                print("Invalid Yandex Disk token provided. Skipping upload.")
+                yandex_disk_client = None
+
+        pipeline_arguments = (args.save_directory, docker_client, args.pull_jobs, args.save_jobs, args.pull_retries,
+                              args.compression, args.compression_level, yandex_disk_client,
+                              args.yandex_disk_directory, args.upload_jobs, args.upload_retries,
+                              args.delete_after_upload, args.queue_size, args.resolve_ids)
+        try:
+            if args.watch:
+                # The Docker connection, the Yandex Disk session, the remote manifest, the parse cache and
+                # the scan state are created once and reused by every cycle.
+                pipeline = ImagePipeline(*pipeline_arguments).start()
+                images = run_watch(scan, pipeline, args.poll_interval, args.watch_cycles)
+            else:
+                images = run_pipeline(scan, *pipeline_arguments)
+        except YandexDiskError as e:
+            print(f"Upload to Yandex Disk failed: {e}")
+            return
+        print(f"Correct images: {images}.\n" if images else "No correct images found.")
+        return images
+
+    images = scan()
 
     if not images:
         print("No correct images found.")
-        return
+        return images
     else:
         print(f"Correct images: {images}.\n")
 
-    save_docker_images(images, args.save_directory)
+    if args.stream_upload:
+        yandex_disk_client = YandexDiskClient(args.yandex_disk_token, pool_size=max(args.save_jobs, args.upload_jobs))
+        if not yandex_disk_client.check_token():
+            print("Invalid Yandex Disk token provided. Skipping upload.")
+            return images
+
+        try:
+            yandex_disk_client.create_directory(args.yandex_disk_directory)
+            manifest = RemoteManifest(args.yandex_disk_directory, yandex_disk_client).load()
+            save_docker_images(images, args.save_directory, args.pull_jobs, args.save_jobs, args.pull_retries,
+                               docker_client, check_daemon=False,
+                               exporter=lambda image: upload_image_stream(
+                                   image, yandex_disk_client, args.yandex_disk_directory, args.compression,
+                                   args.compression_level, docker_client, manifest, args.upload_retries),
+                               resolve_ids=args.resolve_ids)
+            manifest.save()
+        except YandexDiskError as e:
+            print(f"Upload to Yandex Disk failed: {e}")
+        return images
+
+    save_docker_images(images, args.save_directory, args.pull_jobs, args.save_jobs, args.pull_retries,
+                       docker_client, check_daemon=False, export_mode=args.export_mode,
+                       compression=args.compression, compression_level=args.compression_level,
+                       resolve_ids=args.resolve_ids)
 
     if args.yandex_disk_token and args.yandex_disk_directory:
-        if check_yandex_disk_token(args.yandex_disk_token):
-            upload_to_yandex_disk(args.save_directory, args.yandex_disk_token, args.yandex_disk_directory)
-            print("Files uploaded to Yandex Disk successfully.")
+        yandex_disk_client = YandexDiskClient(args.yandex_disk_token, pool_size=args.upload_jobs)
+        if yandex_disk_client.check_token():
+            try:
+                upload_to_yandex_disk(args.save_directory, yandex_disk_client, args.yandex_disk_directory,
+                                      args.upload_jobs, args.upload_retries, args.delete_after_upload)
+                print("Files uploaded to Yandex Disk successfully.")
+            except YandexDiskError as e:
+                print(f"Upload to Yandex Disk failed: {e}")
         else:
             print("Invalid Yandex Disk token provided. Skipping upload.")
     else:
         print("Skipping upload to Yandex Disk. Token or directory not provided.")
+    return images
 
 
 if __name__ == "__main__":
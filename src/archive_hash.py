@@ -0,0 +1,218 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+from .metrics import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HASH_INDEX_FILE_NAME = '.hash_index.json'
+HASH_READ_SIZE = 4 * 1024 * 1024
+TAR_BLOCK_SIZE = 512
+HASH_ALGORITHM = 'blake2b'
+
+# GNU long name/long link records and local/global pax headers describe the members that follow.
+META_TYPES = (b'L', b'K', b'x', b'g')
+REGULAR_FILE_TYPES = (b'0', b'\0', b'7')
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class TarContentHasher:
+    # Push-based tar reader: it is fed raw tar bytes and hashes every regular member without
+    # extracting anything. The final hash covers (member name, member content hash) pairs sorted
+    # by name, so it does not depend on member order, compression or tar metadata.
+    # tarfile's streaming mode ('r|') would need a file object to pull from, while the docker save
+    # stream is pushed through here, the compressor and the output in one pass; reading it with
+    # tarfile would take a second thread and a pipe per archive. Headers follow tarfile's rules:
+    # ustar prefixes, base-256 sizes, GNU 'L'/'K' records and pax 'x'/'g' headers ('g' applies to
+    # every later member, 'x' only to the next one).
+
+    def __init__(self):
+        self.members = []
+        self._header = bytearray()
+        self._remaining = 0
+        self._padding = 0
+        self._done = False
+        self._name = None
+        self._hasher = None
+        self._meta = None
+        self._meta_type = None
+        self._pending = {}
+        self._global = {}
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            if self._remaining:
+                piece = view[:self._remaining]
+                if self._hasher is not None:
+                    self._hasher.update(piece)
+                elif self._meta is not None:
+                    self._meta += piece
+                self._remaining -= len(piece)
+                view = view[len(piece):]
+                if not self._remaining:
+                    self._end_member()
+            elif self._padding:
+                skipped = min(self._padding, len(view))
+                self._padding -= skipped
+                view = view[skipped:]
+            elif self._done:
+                return
+            else:
+                needed = TAR_BLOCK_SIZE - len(self._header)
+                self._header += view[:needed]
+                view = view[needed:]
+                if len(self._header) == TAR_BLOCK_SIZE:
+                    header, self._header = bytes(self._header), bytearray()
+                    self._start_member(header)
+
+    def _start_member(self, header):
+        if not header.strip(b'\0'):
+            self._done = True
+            return
+
+        name = header[0:100].split(b'\0', 1)[0]
+        if header[257:263] == b'ustar\0':
+            prefix = header[345:500].split(b'\0', 1)[0]
+            if prefix:
+                name = prefix + b'/' + name
+
+        size_field = header[124:136]
+        if size_field[0] & 0x80:
+            size = int.from_bytes(size_field[1:], 'big')
+        else:
+            size = int(size_field.strip(b'\0 ') or b'0', 8)
+
+        type_flag = header[156:157]
+        if type_flag in META_TYPES:
+            self._meta, self._meta_type = bytearray(), type_flag
+        else:
+            records = {**self._global, **self._pending}
+            self._name = records.get('path') or name.decode('utf-8', 'surrogateescape')
+            if 'size' in records:
+                size = int(records['size'])
+            self._pending = {}
+            if type_flag in REGULAR_FILE_TYPES:
+                self._hasher = hashlib.blake2b()
+
+        self._remaining = size
+        self._padding = -size % TAR_BLOCK_SIZE
+        if not size:
+            self._end_member()
+
+    def _end_member(self):
+        if self._hasher is not None:
+            self.members.append((self._name, self._hasher.hexdigest()))
+            self._hasher = None
+        elif self._meta is not None:
+            if self._meta_type == b'L':
+                self._pending['path'] = self._meta.split(b'\0', 1)[0].decode('utf-8', 'surrogateescape')
+            elif self._meta_type == b'x':
+                self._pending.update(parse_pax_records(bytes(self._meta)))
+            elif self._meta_type == b'g':
+                self._global.update(parse_pax_records(bytes(self._meta)))
+            # 'K' only carries a long link target, which does not take part in the hash.
+            self._meta = self._meta_type = None
+
+    def hexdigest(self):
+        digest = hashlib.blake2b(digest_size=32)
+        for name, member_digest in sorted(self.members):
+            digest.update(name.encode('utf-8', 'surrogateescape') + b'\0' + member_digest.encode() + b'\n')
+        return f"{HASH_ALGORITHM}:{digest.hexdigest()}"
+
+
+def parse_pax_records(data):
+    records = {}
+    position = 0
+    while position < len(data):
+        length_end = data.find(b' ', position)
+        if length_end < 0:
+            break
+        length = int(data[position:length_end])
+        key, _, value = data[length_end + 1:position + length - 1].partition(b'=')
+        records[key.decode('utf-8', 'surrogateescape')] = value.decode('utf-8', 'surrogateescape')
+        position += length
+    return records
+
+
+def open_archive(file):
+    magic = file.peek(4)[:4] if hasattr(file, 'peek') else b''
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=file)
+    if magic == ZSTD_MAGIC:
+        if zstandard is None:
+            raise OSError("zstd archives require the 'zstandard' package.")
+        return zstandard.ZstdDecompressor().stream_reader(file)
+    return file
+
+
+def calculate_archive_hash(file_path):
+    hasher = TarContentHasher()
+    with open(file_path, 'rb') as file:
+        stream = open_archive(file)
+        while chunk := stream.read(HASH_READ_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class ArchiveHashIndex:
+    def __init__(self, directory):
+        self.path = os.path.join(directory, HASH_INDEX_FILE_NAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Failed to read hash index {self.path}: {e}. Archives will be hashed again.")
+
+    @staticmethod
+    def _stat_key(file_path):
+        stat = os.stat(file_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def record(self, file_path, content_hash):
+        with self._lock:
+            self.entries[os.path.basename(file_path)] = {
+                'stat': self._stat_key(file_path),
+                'hash': content_hash,
+            }
+            self._dirty = True
+
+    def get_hash(self, file_path):
+        name = os.path.basename(file_path)
+        with self._lock:
+            entry = self.entries.get(name)
+        if entry and entry['stat'] == self._stat_key(file_path):
+            metrics.increment('hash_index.hits')
+            return entry['hash']
+
+        metrics.increment('hash_index.misses')
+        with metrics.timer('hash', os.path.getsize(file_path)):
+            content_hash = calculate_archive_hash(file_path)
+        self.record(file_path, content_hash)
+        return content_hash
+
+    def forget(self, file_path):
+        with self._lock:
+            if self.entries.pop(os.path.basename(file_path), None) is not None:
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            with open(f"{self.path}.tmp", 'w', encoding='utf-8') as file:
+                json.dump(self.entries, file)
+            os.replace(f"{self.path}.tmp", self.path)
+            self._dirty = False
@@ -0,0 +1,280 @@
+import re
+import posixpath
+from .yaml_loader import load_yaml
+from .dockerfile_parser import parse_dockerfile_images
+
+ENV_FILE_NAME = '.env'
+DEFAULT_DOCKERFILE = 'Dockerfile'
+COMPOSE_FILE_PATTERN = re.compile(r'(?:docker-)?compose(?:\.[^/]+)?\.ya?ml')
+# The order in which `docker compose` looks for the base file an override file applies to.
+BASE_COMPOSE_FILE_NAMES = ('compose.yaml', 'compose.yml', 'docker-compose.yaml', 'docker-compose.yml')
+VARIABLE_NAME_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+INTERPOLATION_OPERATORS = (':-', ':+', ':?', '-', '+', '?')
+REMOTE_CONTEXT_PREFIXES = ('http://', 'https://', 'git://', 'git@', 'ssh://', 'github.com/')
+
+
+def is_compose_file_name(file_name):
+    # compose.yaml, docker-compose.yml, docker-compose.prod.yml, compose.override.yaml, ...
+    return COMPOSE_FILE_PATTERN.fullmatch(file_name) is not None
+
+
+def find_closing_brace(value, start):
+    depth = 1
+    for index in range(start, len(value)):
+        if value[index] == '{':
+            depth += 1
+        elif value[index] == '}':
+            depth -= 1
+            if not depth:
+                return index
+    return -1
+
+
+def interpolate_braced(expression, variables):
+    # Returns None when the expression cannot be resolved, so the caller keeps it as written.
+    match = VARIABLE_NAME_PATTERN.match(expression)
+    if not match:
+        return None
+    name, rest = match.group(0), expression[match.end():]
+    current = variables.get(name)
+    if not rest:
+        return current
+
+    operator = next((operator for operator in INTERPOLATION_OPERATORS if rest.startswith(operator)), None)
+    if operator is None:
+        return None
+    word = rest[len(operator):]
+    unset = current is None or (operator[0] == ':' and current == '')
+    if operator in (':-', '-'):
+        return interpolate(word, variables) if unset else current
+    if operator in (':+', '+'):
+        return '' if unset else interpolate(word, variables)
+    # ${NAME:?error} fails the compose run when NAME is missing.
+    return None if unset else current
+
+
+def interpolate(value, variables):
+    # Compose interpolation: $NAME, ${NAME}, ${NAME:-default}, ${NAME-default}, ${NAME:+alt}, ${NAME+alt},
+    # ${NAME:?error}, nested defaults and "$$" for a literal "$". Unresolved variables stay as written, so
+    # the image is dropped as unresolved instead of being pulled under a wrong name.
+    if '$' not in value:
+        return value
+
+    result = []
+    index = 0
+    while index < len(value):
+        character = value[index]
+        following = value[index + 1:index + 2]
+        if character != '$' or not following:
+            result.append(character)
+            index += 1
+        elif following == '$':
+            result.append('$')
+            index += 2
+        elif following == '{':
+            end = find_closing_brace(value, index + 2)
+            if end < 0:
+                result.append(value[index:])
+                break
+            resolved = interpolate_braced(value[index + 2:end], variables)
+            result.append(value[index:end + 1] if resolved is None else resolved)
+            index = end + 1
+        else:
+            match = VARIABLE_NAME_PATTERN.match(value, index + 1)
+            if match and match.group(0) in variables:
+                result.append(variables[match.group(0)])
+                index = match.end()
+            else:
+                result.append(character)
+                index += 1
+    return ''.join(result)
+
+
+def parse_env_file(content):
+    # KEY=VALUE lines with optional "export", comments, and single (literal) or double quoted values.
+    # Later values may refer to earlier ones.
+    variables = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('export '):
+            line = line[len('export '):].lstrip()
+
+        name, separator, value = line.partition('=')
+        name = name.strip()
+        if not separator or not VARIABLE_NAME_PATTERN.fullmatch(name):
+            continue
+
+        value = value.strip()
+        if value[:1] == "'" and "'" in value[1:]:
+            variables[name] = value[1:value.index("'", 1)]
+            continue
+        if value[:1] == '"' and '"' in value[1:]:
+            value = value[1:value.index('"', 1)]
+        else:
+            value = value.split(' #', 1)[0].rstrip()
+        variables[name] = interpolate(value, variables)
+    return variables
+
+
+def as_build(build):
+    if isinstance(build, str):
+        return {'context': build}
+    return dict(build) if isinstance(build, dict) else {}
+
+
+def merge_service(base, override):
+    # Mappings are merged key by key (so "build.args" of an override extends the base ones),
+    # everything else is replaced, as in `docker compose` merging.
+    merged = dict(base)
+    for key, value in override.items():
+        if key == 'build':
+            value = as_build(value)
+            if 'build' in merged:
+                value = merge_service(as_build(merged['build']), value)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = merge_service(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def merge_documents(documents):
+    # Later documents of a multi-document compose file are merged over the earlier ones.
+    merged = {}
+    for document in documents:
+        if isinstance(document, dict):
+            merged = merge_service(merged, document)
+    return merged
+
+
+def get_build_args(args, variables):
+    # "args" is a mapping or a list of "NAME=value"; a name without a value is taken from the environment.
+    if isinstance(args, list):
+        args = dict(item.partition('=')[::2] if '=' in item else (item, None) for item in args
+                    if isinstance(item, str))
+    if not isinstance(args, dict):
+        return {}
+
+    build_args = {}
+    for name, value in args.items():
+        if value is None:
+            value = variables.get(str(name))
+        if value is not None:
+            build_args[str(name)] = interpolate(str(value), variables)
+    return build_args
+
+
+class ComposeResolver:
+    # Resolves the images a compose file really uses. read_file(path) returns the text of a file given by
+    # its repository-relative path, or None if there is no such file; every path asked for is recorded in
+    # dependencies, so a cached result can be checked against the files it was computed from.
+    # documents may be shared by the resolvers of every compose file of one tree, so that a base file
+    # used by several overrides and extends is loaded once; get_sha(path), if given, keys it by content.
+
+    def __init__(self, read_file, source=None, documents=None, get_sha=None):
+        self.read_file = read_file
+        self.source = source
+        self.dependencies = set()
+        self._documents = documents if documents is not None else {}
+        self._get_sha = get_sha
+
+    def read(self, path):
+        self.dependencies.add(path)
+        return self.read_file(path)
+
+    def load(self, path):
+        self.dependencies.add(path)
+        key = (path, self._get_sha(path) if self._get_sha is not None else None)
+        if key not in self._documents:
+            content = self.read_file(path)
+            documents = load_yaml(content, self.source or path) if content is not None else []
+            self._documents[key] = merge_documents(documents)
+        return self._documents[key]
+
+    def get_services(self, path):
+        services = self.load(path).get('services')
+        return services if isinstance(services, dict) else {}
+
+    def find_base_file(self, path):
+        # docker-compose.override.yml or compose.prod.yaml is applied on top of the base file next to it.
+        directory, name = posixpath.split(path)
+        if name in BASE_COMPOSE_FILE_NAMES:
+            return None
+        for base_name in BASE_COMPOSE_FILE_NAMES:
+            base_path = posixpath.join(directory, base_name)
+            if self.load(base_path):
+                return base_path
+        return None
+
+    def resolve_service(self, path, name, variables, seen=()):
+        # Returns the service with its "extends" chain applied and the directory its build paths are relative to.
+        service = self.get_services(path).get(name)
+        if not isinstance(service, dict) or (path, name) in seen:
+            return {}, posixpath.dirname(path)
+
+        extends = service.get('extends')
+        if isinstance(extends, str):
+            extends = {'service': extends}
+        if not isinstance(extends, dict) or not extends.get('service'):
+            return service, posixpath.dirname(path)
+
+        base_path = path
+        if extends.get('file'):
+            base_path = posixpath.normpath(posixpath.join(posixpath.dirname(path),
+                                                          interpolate(str(extends['file']), variables)))
+        base, base_directory = self.resolve_service(base_path, str(extends['service']), variables,
+                                                    (*seen, (path, name)))
+        # A build inherited from another file keeps paths relative to that file.
+        directory = posixpath.dirname(path) if 'build' in service else base_directory
+        return merge_service(base, {key: value for key, value in service.items() if key != 'extends'}), directory
+
+    def get_build_images(self, build, directory, variables):
+        build = as_build(build)
+        build_args = get_build_args(build.get('args'), variables)
+        inline = build.get('dockerfile_inline')
+        if isinstance(inline, str):
+            return parse_dockerfile_images(inline, build_args)
+
+        context = interpolate(str(build.get('context') or '.'), variables)
+        dockerfile = interpolate(str(build.get('dockerfile') or DEFAULT_DOCKERFILE), variables)
+        if context.startswith(REMOTE_CONTEXT_PREFIXES) or '$' in context + dockerfile:
+            return []
+        if posixpath.isabs(context) or posixpath.isabs(dockerfile):
+            return []
+
+        dockerfile_path = posixpath.normpath(posixpath.join(directory, context, dockerfile))
+        if dockerfile_path.startswith('../'):
+            return []
+        content = self.read(dockerfile_path)
+        return parse_dockerfile_images(content, build_args) if content is not None else []
+
+    def resolve(self, path):
+        # Variables come from the .env file of the project directory only: the environment of the
+        # machine running the collector says nothing about how the repository is deployed.
+        env_content = self.read(posixpath.join(posixpath.dirname(path), ENV_FILE_NAME))
+        variables = parse_env_file(env_content) if env_content is not None else {}
+
+        base_path = self.find_base_file(path)
+        images = []
+        for name in self.get_services(path):
+            service, directory = self.resolve_service(path, name, variables)
+            if base_path is not None and name in self.get_services(base_path):
+                base, base_directory = self.resolve_service(base_path, name, variables)
+                directory = directory if 'build' in service else base_directory
+                service = merge_service(base, service)
+
+            # With "build", "image" is only the tag compose gives the locally built image, so it is not
+            # pulled; the base images of the Dockerfile are.
+            if service.get('build'):
+                images.extend(self.get_build_images(service['build'], directory, variables))
+            elif isinstance(service.get('image'), str):
+                images.append(interpolate(service['image'], variables))
+        return list(dict.fromkeys(images))
+
+
+def resolve_compose_images(path, read_file, source=None, documents=None, get_sha=None):
+    # Returns (images, paths of the other files the result depends on).
+    resolver = ComposeResolver(read_file, source, documents, get_sha)
+    images = resolver.resolve(path)
+    return images, sorted(resolver.dependencies - {path})
@@ -0,0 +1,213 @@
+import os
+import json
+import base64
+import socket
+import subprocess
+import threading
+import http.client
+from urllib.parse import urlencode, quote
+from .exception import DockerEngineError
+from .image_reference import parse_image_reference, format_image_reference, DEFAULT_REGISTRY
+
+DEFAULT_DOCKER_SOCKET = '/var/run/docker.sock'
+STREAM_CHUNK_SIZE = 1024 * 1024
+DOCKER_HUB_AUTH_KEY = 'https://index.docker.io/v1/'
+IDENTITY_TOKEN_USERNAME = '<token>'
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def split_image_reference(image):
+    # The create endpoint takes the image name and a tag or digest separately; a digest wins over a tag.
+    reference = parse_image_reference(image)
+    if reference is None:
+        return image, 'latest'
+    name = format_image_reference(reference._replace(tag=None, digest=None))
+    return name, reference.digest or reference.tag or 'latest'
+
+
+def load_docker_config():
+    path = os.path.join(os.environ.get('DOCKER_CONFIG') or os.path.expanduser('~/.docker'), 'config.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_credentials_from_helper(helper, server):
+    try:
+        result = subprocess.run([f"docker-credential-{helper}", "get"], input=server, text=True, check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return json.loads(result.stdout)
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+def get_registry_auth(registry, config=None):
+    # The same credentials `docker pull` uses: a credential helper for the registry, the default
+    # credential store or a base64 "auth" entry in ~/.docker/config.json. Returns None when there are none.
+    config = load_docker_config() if config is None else config
+    server = DOCKER_HUB_AUTH_KEY if registry == DEFAULT_REGISTRY else registry
+
+    helper = (config.get('credHelpers') or {}).get(server) or config.get('credsStore')
+    if helper:
+        credentials = get_credentials_from_helper(helper, server)
+        if credentials and credentials.get('Secret'):
+            if credentials.get('Username') == IDENTITY_TOKEN_USERNAME:
+                return {'identitytoken': credentials['Secret'], 'serveraddress': server}
+            return {'username': credentials.get('Username'), 'password': credentials['Secret'],
+                    'serveraddress': server}
+
+    auths = config.get('auths') or {}
+    entry = auths.get(server) or auths.get(f"https://{server}") or {}
+    if entry.get('identitytoken'):
+        return {'identitytoken': entry['identitytoken'], 'serveraddress': server}
+    if entry.get('auth'):
+        try:
+            username, _, password = base64.b64decode(entry['auth']).decode().partition(':')
+        except ValueError:
+            return None
+        return {'username': username, 'password': password, 'serveraddress': server}
+    return None
+
+
+def encode_registry_auth(auth):
+    return base64.urlsafe_b64encode(json.dumps(auth).encode()).decode()
+
+
+class DockerEngineClient:
+    def __init__(self, socket_path=DEFAULT_DOCKER_SOCKET, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _get_connection(self):
+        # http.client connections are not thread-safe, so every thread keeps its own keep-alive connection.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = UnixHTTPConnection(self.socket_path, self.timeout)
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def request(self, method, path, params=None, headers=None):
+        url = f"{path}?{urlencode(params, doseq=True)}" if params else path
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                connection.request(method, url, headers={'Host': 'docker', **(headers or {})})
+                return connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                # The daemon closed an idle keep-alive connection; reconnect once.
+                self.close()
+                if attempt:
+                    raise DockerEngineError(f"Docker daemon at {self.socket_path} closed the connection: {e}")
+            except OSError as e:
+                self.close()
+                raise DockerEngineError(f"Cannot connect to the Docker daemon at {self.socket_path}: {e}")
+
+    def request_json(self, method, path, params=None):
+        response = self.request(method, path, params)
+        body = response.read()
+        if response.status >= 400:
+            raise DockerEngineError(f"{method} {path} failed with {response.status}: {body.decode(errors='replace')}")
+        return json.loads(body) if body else None
+
+    def ping(self):
+        try:
+            response = self.request('GET', '/_ping')
+            response.read()
+            return response.status == 200
+        except DockerEngineError:
+            return False
+
+    def list_images(self):
+        images = set()
+        for image in self.request_json('GET', '/images/json') or []:
+            images.update(tag for tag in image.get('RepoTags') or [] if tag != '<none>:<none>')
+            images.update(digest for digest in image.get('RepoDigests') or [] if not digest.startswith('<none>'))
+        return images
+
+    def image_exists(self, image):
+        response = self.request('GET', f"/images/{quote(image, safe='')}/json")
+        response.read()
+        return response.status == 200
+
+    def inspect_image(self, image):
+        return self.request_json('GET', f"/images/{quote(image, safe='')}/json")
+
+    def pull_image(self, image, progress=None):
+        name, tag = split_image_reference(image)
+        # Unlike the CLI, the API does not read ~/.docker/config.json, so private registries need the header.
+        reference = parse_image_reference(image)
+        auth = get_registry_auth(reference.registry) if reference is not None else None
+        headers = {'X-Registry-Auth': encode_registry_auth(auth)} if auth else None
+        response = self.request('POST', '/images/create', {'fromImage': name, 'tag': tag}, headers)
+        if response.status >= 400:
+            raise DockerEngineError(f"Pull of {image} failed with {response.status}: "
+                                    f"{response.read().decode(errors='replace')}")
+
+        # Errors that happen after the pull started arrive as a JSON line in a 200 response.
+        error = None
+        while line := response.readline():
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if 'error' in message:
+                error = message['error']
+            elif progress:
+                progress(message)
+
+        if error:
+            raise DockerEngineError(f"Pull of {image} failed: {error}")
+
+    def export_images(self, images, chunk_size=STREAM_CHUNK_SIZE):
+        response = self.request('GET', '/images/get', {'names': list(images)})
+        if response.status >= 400:
+            raise DockerEngineError(f"Export of {', '.join(images)} failed with {response.status}: "
+                                    f"{response.read().decode(errors='replace')}")
+
+        completed = False
+        try:
+            while chunk := response.read(chunk_size):
+                yield chunk
+            completed = True
+        finally:
+            if not completed:
+                # A partially read response leaves the keep-alive connection unusable.
+                self.close()
+
+
+def get_docker_socket_path():
+    docker_host = os.environ.get('DOCKER_HOST')
+    if not docker_host:
+        return DEFAULT_DOCKER_SOCKET
+    if docker_host.startswith('unix://'):
+        return docker_host[len('unix://'):]
+    # TCP and SSH hosts are left to the docker CLI.
+    return None
+
+
+def get_docker_client(socket_path=None):
+    socket_path = socket_path or get_docker_socket_path()
+    if not socket_path or not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+
+    client = DockerEngineClient(socket_path)
+    return client if client.ping() else None
@@ -1,35 +1,47 @@
 import os
+import io
 import re
+import contextlib
+import traceback
 import itertools
-import yaml
-import tempfile
-from git import Repo, GitCommandError, InvalidGitRepositoryError
+import posixpath
+from git import Repo, GitCommandError, InvalidGitRepositoryError, NoSuchPathError
 from .exception import GitRepositoryError, InvalidGitRepository, BranchCheckoutError
-from urllib.parse import urlparse
+from .parse_cache import ParseCache, git_blob_sha
+from .scan_state import ScanState, TREE_SCAN_MODE
+from .variable_substitution import VariableIndex, compile_template
+from .fs_walker import iter_repositories, iter_files
+from .repo_mirror import sync_mirrors, prefetch_blobs, DEFAULT_MIRROR_DIRECTORY, DEFAULT_CLONE_JOBS
+from .image_reference import normalize_images
+from .dockerfile_parser import parse_dockerfile_images
+from .yaml_loader import load_yaml
+from .compose_resolver import is_compose_file_name, resolve_compose_images, ENV_FILE_NAME
+from .metrics import metrics
+from .image_catalog import get_repository_origin
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
+CHECKOUT_SCAN_MODE = 'checkout'
+SCAN_MODES = (TREE_SCAN_MODE, CHECKOUT_SCAN_MODE)
 
-def scan_repositories(base_path):
-    return [
-        root for root, dirs, files in os.walk(base_path) if '.git' in dirs
-    ]
+DOCKERFILE = 'dockerfile'
+DOCKER_COMPOSE = 'docker-compose'
+GITHUB_ACTIONS = 'github-actions'
+DOCKERFILE_NAMES = ('Dockerfile', 'Containerfile')
+DOCKERIGNORE_SUFFIX = '.dockerignore'
 
+MAX_EXPRESSION_COMBINATIONS = 1000
+# Repositories submitted to the scan process pool ahead of the results, per worker.
+POOL_SUBMIT_WINDOW = 2
 
-def scan_remote_repos(repo_urls):
-    repos = []
-    for url in repo_urls:
-        try:
-            parsed_url = urlparse(url)
-            repo_name = os.path.splitext(os.path.basename(parsed_url.path))[0]
-            local_path = os.path.join(tempfile.gettempdir(), repo_name)
+IMAGE_KEY_PATTERN = re.compile(r'\bimage[\'"]?\s*:')
+
+
+def scan_repositories(base_path, ignore_patterns=(), use_gitignore=False, nested=False):
+    return iter_repositories(base_path, ignore_patterns, use_gitignore, nested)
 
-            if os.path.exists(local_path):
-                repos.append(local_path)
-            else:
-                Repo.clone_from(url, local_path)
-                repos.append(local_path)
-        except GitCommandError as e:
-            raise GitRepositoryError(f"Error cloning repository: {e}")
-    return repos
+
+def scan_remote_repos(repo_urls, mirror_directory=DEFAULT_MIRROR_DIRECTORY, clone_jobs=DEFAULT_CLONE_JOBS):
+    return sync_mirrors(repo_urls, mirror_directory, clone_jobs)
 
 
 def get_all_branches(repo_path):
@@ -47,6 +59,22 @@ def get_all_branches(repo_path):
         raise GitRepositoryError(f"Error: {e}")
 
 
+def get_branch_refs(repo):
+    try:
+        refs = {head.name: head.commit.hexsha for head in repo.heads}
+
+        if 'origin' in repo.remotes:
+            for ref in repo.remote('origin').refs:
+                if ref.remote_head != 'HEAD':
+                    refs.setdefault(ref.remote_head, ref.commit.hexsha)
+
+        return refs
+    except InvalidGitRepositoryError as e:
+        raise InvalidGitRepository(f"Invalid git repository: {e}")
+    except ValueError as e:
+        raise GitRepositoryError(f"Error: {e}")
+
+
 def has_unmerged_paths(repo):
     return bool(repo.index.unmerged_blobs())
 
@@ -99,57 +127,50 @@ def checkout_branch(repo, branch_name):
         raise GitRepositoryError(f"Error accessing repository")
 
 
+def parse_dockerfile_content(content, source=None):
+    return parse_dockerfile_images(content)
+
+
 def parse_dockerfile(dockerfile_path):
-    images = []
     with open(dockerfile_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            if line.startswith('FROM'):
-                images.append(line.split()[1])
-    return images
+        return parse_dockerfile_content(file.read(), dockerfile_path)
 
 
-def parse_docker_compose(compose_path):
-    images = []
-    with open(compose_path, 'r', encoding='utf-8') as file:
-        compose_content = yaml.safe_load(file)
-        services = compose_content.get('services', {})
-        for service in services.values():
-            image = service.get('image')
-            if image:
-                images.append(image)
+def parse_docker_compose_content(content, source=None):
+    # Without the rest of the tree only the file itself is used: no .env, extended files or Dockerfiles.
+    path = posixpath.basename(source or 'docker-compose.yml')
+    images, _ = resolve_compose_images(path, lambda file_path: content if file_path == path else None, source)
     return images
 
 
-import itertools
+def read_text_file(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+            return file.read()
+    except OSError:
+        return None
 
 
-def find_images_recursive(data, variables=None):
-    images = []
-    variables = variables or {}
+def parse_docker_compose(compose_path):
+    directory = os.path.dirname(os.path.abspath(compose_path))
+    images, _ = resolve_compose_images(
+        os.path.basename(compose_path), lambda path: read_text_file(os.path.join(directory, path)), compose_path
+    )
+    return images
+
 
+def find_image_templates(data):
+    templates = []
     if isinstance(data, dict):
         for key, value in data.items():
             if key == 'image' and isinstance(value, str):
-                images.append(replace_variables(value, variables))
+                templates.append(value)
             else:
-                images.extend(find_images_recursive(value, variables))
+                templates.extend(find_image_templates(value))
     elif isinstance(data, list):
         for item in data:
-            images.extend(find_images_recursive(item, variables))
-    return images
-
-
-def replace_variables(value, variables):
-    pattern = re.compile(r'\$\{\{\s*(.*?)\s*\}\}')
-
-    def replacer(match):
-        var_name = match.group(1)
-        for var_key, var_value in variables.items():
-            if var_key.endswith(var_name):
-                return str(var_value)
-        return match.group(0)
-
-    return pattern.sub(replacer, value)
+            templates.extend(find_image_templates(item))
+    return templates
 
 
 def extract_variables(data):
@@ -181,49 +202,366 @@ def extract_variables(data):
     return variables
 
 
-def generate_combinations(variables):
-    keys = list(variables.keys())
-    values = list(itertools.product(*[v if isinstance(v, list) else [v] for v in variables.values()]))
-    return [dict(zip(keys, combo)) for combo in values]
+def as_list(value):
+    return value if isinstance(value, list) else [value]
 
 
-def parse_github_actions(actions_path):
+def matches_matrix_entry(combination, entry, keys=None):
+    return all(
+        key in combination and combination[key] == value
+        for key, value in entry.items() if keys is None or key in keys
+    )
+
+
+def expand_matrix(matrix, keys, limit=MAX_EXPRESSION_COMBINATIONS):
+    include = [entry for entry in as_list(matrix.get('include') or []) if isinstance(entry, dict)]
+    exclude = [entry for entry in as_list(matrix.get('exclude') or []) if isinstance(entry, dict)]
+    all_dimensions = [key for key in matrix if key not in ('include', 'exclude')]
+
+    # Dimensions that are neither referenced nor used by include/exclude cannot change
+    # the projected result, so they are left out of the product entirely.
+    relevant = set(keys)
+    for entry in include + exclude:
+        relevant.update(entry)
+    dimensions = [key for key in all_dimensions if key in relevant]
+
+    combinations = [{}] if all_dimensions and not dimensions else []
+    truncated = False
+    if dimensions:
+        product = itertools.product(*[as_list(matrix[key]) for key in dimensions])
+        for values in product:
+            if len(combinations) >= limit:
+                truncated = True
+                break
+            combination = dict(zip(dimensions, values))
+            if not any(matches_matrix_entry(combination, entry) for entry in exclude):
+                combinations.append(combination)
+
+    extra = []
+    for entry in include:
+        matched = False
+        for combination in combinations:
+            if matches_matrix_entry(combination, entry, dimensions):
+                combination.update(entry)
+                matched = True
+        if not matched:
+            extra.append(dict(entry))
+    combinations.extend(extra)
+
+    projected = {}
+    for combination in combinations:
+        values = {key: combination[key] for key in keys if key in combination}
+        projected.setdefault(tuple((key, str(value)) for key, value in values.items()), values)
+
+    return list(projected.values()) or [{}], truncated
+
+
+def expand_image_template(template, matrix, variable_index, source=None, limit=MAX_EXPRESSION_COMBINATIONS):
+    compiled = compile_template(template)
+    names = compiled.names
+    if not names:
+        return [template]
+
+    value_sets = []
+    truncated = False
+    if isinstance(matrix, dict):
+        matrix_keys = [name[len('matrix.'):] for name in names if name.startswith('matrix.')]
+        if matrix_keys:
+            combinations, truncated = expand_matrix(matrix, matrix_keys, limit)
+            value_sets.append([
+                {f"matrix.{key}": str(value) for key, value in combination.items()}
+                for combination in combinations
+            ])
+    # matrix.* names belong to this job's matrix alone; without a literal one they stay unresolved
+    # instead of being taken from another job's matrix through the variable index.
+    names = [name for name in names if not name.startswith('matrix.')]
+
+    for name in names:
+        value = variable_index.lookup(name)
+        if value is not None:
+            value_sets.append([{name: str(item)} for item in as_list(value)])
+
+    images = []
+    for combination in itertools.product(*value_sets):
+        if len(images) >= limit:
+            truncated = True
+            break
+        values = {}
+        for part in combination:
+            values.update(part)
+        images.append(compiled.render(values))
+
+    if truncated:
+        print(f"Warning: expansion of image '{template}' in {source} was capped at {limit} combinations.")
+
+    return images
+
+
+def get_workflow_scopes(actions_content):
+    jobs = actions_content.get('jobs') if isinstance(actions_content, dict) else None
+    if not isinstance(jobs, dict):
+        return [(actions_content, None)]
+
+    scopes = []
+    for job in jobs.values():
+        strategy = job.get('strategy') if isinstance(job, dict) else None
+        matrix = strategy.get('matrix') if isinstance(strategy, dict) else None
+        scopes.append((job, matrix))
+    scopes.append(({key: value for key, value in actions_content.items() if key != 'jobs'}, None))
+    return scopes
+
+
+def parse_github_actions_content(content, source=None):
     images = []
+    # Helm charts, OpenAPI specs and translation bundles rarely have an `image:` key;
+    # a regex search is far cheaper than building the whole document.
+    if not IMAGE_KEY_PATTERN.search(content):
+        return images
+
+    # Each document of a multi-document file keeps its own variables.
+    for actions_content in load_yaml(content, source):
+        variable_index = VariableIndex(extract_variables(actions_content))
+        for data, matrix in get_workflow_scopes(actions_content):
+            for template in find_image_templates(data):
+                images.extend(expand_image_template(template, matrix, variable_index, source))
+
+    return images
+
+
+def parse_github_actions(actions_path):
     try:
         with open(actions_path, 'r', encoding='utf-8') as file:
-            actions_content = yaml.safe_load(file)
-            if not actions_content:
-                return images
+            content = file.read()
+    except IOError as e:
+        raise GitRepositoryError(f"Error parsing YAML file {actions_path}: {e}")
 
-            variables = extract_variables(actions_content)
-            variable_combinations = generate_combinations(variables)
+    return parse_github_actions_content(content, actions_path)
+
+
+CONTENT_PARSERS = {
+    DOCKERFILE: parse_dockerfile_content,
+    DOCKER_COMPOSE: parse_docker_compose_content,
+    GITHUB_ACTIONS: parse_github_actions_content,
+}
+
+
+def is_dockerfile_name(file_name):
+    # Dockerfile, Containerfile, Dockerfile.dev, api.Dockerfile; not Dockerfile.dockerignore.
+    if file_name.endswith(DOCKERIGNORE_SUFFIX):
+        return False
+    return any(file_name == base or file_name.startswith(f"{base}.") or file_name.endswith(f".{base}")
+               for base in DOCKERFILE_NAMES)
+
+
+def classify_docker_file(file_name):
+    if is_dockerfile_name(file_name):
+        return DOCKERFILE
+    elif is_compose_file_name(file_name):
+        return DOCKER_COMPOSE
+    elif file_name.endswith('.yml') or file_name.endswith('.yaml'):
+        return GITHUB_ACTIONS
+    return None
+
+
+def read_file(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read()
+
+
+def process_docker_files_by_path(repo_path, parse_cache=None, ignore_patterns=(), use_gitignore=False):
+    # Returns {path relative to the repository: images} for the files that contain images.
+    parse_cache = parse_cache if parse_cache is not None else ParseCache()
+    # The working copy does not change during the scan, so compose documents are keyed by path alone.
+    compose_documents = {}
+    files = {}
+    for root, file in iter_files(repo_path, ignore_patterns, use_gitignore):
+        kind = classify_docker_file(file)
+        if not kind:
+            continue
+
+        file_path = os.path.join(root, file)
+        path = os.path.relpath(file_path, repo_path).replace(os.sep, '/')
+        data = read_file(file_path)
+        if kind == DOCKER_COMPOSE:
+            images = parse_cache.get_or_resolve(
+                kind, git_blob_sha(data), path,
+                lambda dependency: get_working_tree_sha(repo_path, dependency),
+                lambda: resolve_compose_images(
+                    path, lambda dependency: read_text_file(os.path.join(repo_path, dependency)), file_path,
+                    compose_documents
+                )
+            )
+        else:
+            images = parse_cache.get_or_parse(
+                kind, git_blob_sha(data),
+                lambda: data.decode('utf-8', errors='replace'),
+                lambda content: CONTENT_PARSERS[kind](content, file_path)
+            )
+        if images:
+            files[path] = images
 
-            for combination in variable_combinations:
-                images.extend(find_images_recursive(actions_content, combination))
+    return files
 
-    except (yaml.YAMLError, IOError) as e:
-        raise GitRepositoryError(f"Error parsing YAML file {actions_path}: {e}")
 
-    return images
+def get_working_tree_sha(repo_path, path):
+    file_path = os.path.join(repo_path, path)
+    return git_blob_sha(read_file(file_path)) if os.path.isfile(file_path) else None
+
+
+def process_docker_files(repo_path, parse_cache=None, ignore_patterns=(), use_gitignore=False):
+    files = process_docker_files_by_path(repo_path, parse_cache, ignore_patterns, use_gitignore)
+    return [image for images in files.values() for image in images]
+
 
+def list_docker_files_in_tree(repo, commit, blobs=None):
+    # blobs, if given, receives path -> sha of every blob in the tree: compose files need it
+    # to find their .env, extended compose files and build Dockerfiles.
+    docker_files = []
+    for entry in repo.git.ls_tree('-r', '-z', '--full-tree', commit).split('\0'):
+        if not entry:
+            continue
 
-def process_docker_files(repo_path):
-    docker_images = []
-    for root, dirs, files in os.walk(repo_path):
-        for file in files:
-            if file == 'Dockerfile':
-                docker_images.extend(parse_dockerfile(os.path.join(root, file)))
-            elif file == 'docker-compose.yml':
-                docker_images.extend(parse_docker_compose(os.path.join(root, file)))
-            elif file.endswith('.yml') or file.endswith('.yaml'):
-                docker_images.extend(parse_github_actions(os.path.join(root, file)))
+        info, path = entry.split('\t', 1)
+        _, object_type, sha = info.split()
+        if object_type != 'blob':
+            continue
+        if blobs is not None:
+            blobs[path] = sha
 
-    return docker_images
+        kind = classify_docker_file(posixpath.basename(path))
+        if kind:
+            docker_files.append((path, sha, kind))
+    return docker_files
 
 
-def process_repository_images(repo_path):
+def read_blob(repo, sha):
+    # Served by the repository's persistent `git cat-file --batch` process.
+    _, _, _, data = repo.git.get_object_data(sha)
+    return data.decode('utf-8', errors='replace')
+
+
+def has_compose_files(docker_files):
+    return any(kind == DOCKER_COMPOSE for _, _, kind in docker_files)
+
+
+def process_tree_docker_files_by_path(repo, commit, parse_cache=None, docker_files=None, blobs=None):
+    parse_cache = parse_cache if parse_cache is not None else ParseCache()
+    if docker_files is None:
+        blobs = {}
+        docker_files = list_docker_files_in_tree(repo, commit, blobs)
+    elif blobs is None and has_compose_files(docker_files):
+        blobs = {}
+        list_docker_files_in_tree(repo, commit, blobs)
+
+    def read_path(path):
+        return read_blob(repo, blobs[path]) if path in blobs else None
+
+    compose_documents = {}
+    files = {}
+    for path, sha, kind in docker_files:
+        source = f"{commit[:12]}:{path}"
+        if kind == DOCKER_COMPOSE:
+            images = parse_cache.get_or_resolve(
+                kind, sha, path, blobs.get,
+                lambda: resolve_compose_images(path, read_path, source, compose_documents, blobs.get)
+            )
+        else:
+            images = parse_cache.get_or_parse(
+                kind, sha,
+                lambda: read_blob(repo, sha),
+                lambda content: CONTENT_PARSERS[kind](content, source)
+            )
+        if images:
+            files[path] = images
+
+    return files
+
+
+def get_branch_entry(commit, files, scan_mode=TREE_SCAN_MODE):
+    images = sorted({image for file_images in files.values() for image in file_images})
+    return {'commit': commit, 'images': images, 'files': files, 'scan_mode': scan_mode}
+
+
+def get_prefetch_shas(listings, parse_cache):
+    # Unparsed docker files plus the .env files next to compose files; other compose dependencies
+    # (build Dockerfiles, extended files) are mostly docker files already.
+    shas = set()
+    for docker_files, blobs in listings:
+        for path, sha, kind in docker_files:
+            if not parse_cache.contains(kind, sha, path if kind == DOCKER_COMPOSE else None):
+                shas.add(sha)
+            if kind == DOCKER_COMPOSE and blobs:
+                shas.add(blobs.get(posixpath.join(posixpath.dirname(path), ENV_FILE_NAME)))
+    shas.discard(None)
+    return shas
+
+
+def process_repository_tree_images(repo_path, parse_cache=None, scan_state=None):
+    parse_cache = parse_cache if parse_cache is not None else ParseCache()
+    scan_state = scan_state if scan_state is not None else ScanState()
+    all_images = set()
+    try:
+        repo = Repo(repo_path)
+    except (InvalidGitRepositoryError, NoSuchPathError) as e:
+        print(f"Invalid git repository {repo_path}: {e}")
+        return all_images
+
+    try:
+        branch_refs = get_branch_refs(repo)
+        commit_files = {}
+        changed_commits = {}
+        for branch, commit in branch_refs.items():
+            if commit in commit_files or commit in changed_commits:
+                continue
+
+            entry = scan_state.get_branch(repo_path, branch, commit)
+            if entry is None:
+                blobs = {}
+                with metrics.timer('scan.list_tree'):
+                    docker_files = list_docker_files_in_tree(repo, commit, blobs)
+                # The full listing is only kept for trees whose compose files may need other files.
+                changed_commits[commit] = (docker_files, blobs if has_compose_files(docker_files) else None)
+            else:
+                commit_files[commit] = entry['files']
+
+        with metrics.timer('scan.prefetch'):
+            prefetch_blobs(repo, list(changed_commits), get_prefetch_shas(changed_commits.values(), parse_cache))
+
+        for commit, (docker_files, blobs) in changed_commits.items():
+            with metrics.timer('scan.branch'):
+                commit_files[commit] = process_tree_docker_files_by_path(repo, commit, parse_cache, docker_files,
+                                                                         blobs or {})
+
+        branches = {}
+        for branch, commit in branch_refs.items():
+            branches[branch] = get_branch_entry(commit, commit_files[commit])
+            all_images.update(branches[branch]['images'])
+
+        scan_state.update_repository(repo_path, branches)
+
+    except (GitRepositoryError, GitCommandError, ValueError) as e:
+        print(f"Failed to scan repository {repo_path}: {e}")
+
+    finally:
+        repo.close()
+
+    return all_images
+
+
+def process_repository_images(repo_path, scan_mode=TREE_SCAN_MODE, parse_cache=None, scan_state=None,
+                              ignore_patterns=(), use_gitignore=False):
+    with metrics.timer('scan.repository'):
+        if scan_mode == TREE_SCAN_MODE:
+            return process_repository_tree_images(repo_path, parse_cache, scan_state)
+        return process_repository_checkout_images(repo_path, parse_cache, ignore_patterns, scan_state,
+                                                  use_gitignore)
+
+
+def process_repository_checkout_images(repo_path, parse_cache=None, ignore_patterns=(), scan_state=None,
+                                       use_gitignore=False):
     all_images = set()
     original_branch = None
+    scanned_branches = {}
     try:
         repo = Repo(repo_path)
         branches = get_all_branches(repo_path)
@@ -231,17 +569,22 @@ def process_repository_images(repo_path):
         original_branch = repo.active_branch.name
 
         for branch in branches:
-            checkout_result = checkout_branch(repo, branch)
+            with metrics.timer('scan.checkout'):
+                checkout_result = checkout_branch(repo, branch)
 
             if not checkout_result:
                 break
 
-            images = process_docker_files(repo_path)
-            all_images |= set(images)
+            with metrics.timer('scan.branch'):
+                files = process_docker_files_by_path(repo_path, parse_cache, ignore_patterns, use_gitignore)
+            scanned_branches[branch] = get_branch_entry(repo.head.commit.hexsha, files, CHECKOUT_SCAN_MODE)
+            all_images |= set(scanned_branches[branch]['images'])
 
     except BranchCheckoutError as e:
-        images = process_docker_files(repo_path)
-        all_images |= set(images)
+        files = process_docker_files_by_path(repo_path, parse_cache, ignore_patterns, use_gitignore)
+        if original_branch:
+            scanned_branches[original_branch] = get_branch_entry(repo.head.commit.hexsha, files, CHECKOUT_SCAN_MODE)
+        all_images |= {image for images in files.values() for image in images}
 
     except (InvalidGitRepository, GitRepositoryError, InvalidGitRepositoryError, ValueError) as e:
         pass
@@ -255,42 +598,164 @@ def process_repository_images(repo_path):
             except BranchCheckoutError as e:
                 print(f"Failed to return to the original branch '{original_branch}': {e}")
 
+    # Recorded so that the catalog knows which file of which branch every image came from. Tree scans
+    # never reuse these entries: they honour --ignore and include untracked working tree files.
+    if scan_state is not None and scanned_branches:
+        scan_state.update_repository(repo_path, scanned_branches)
+
     return all_images
 
 
 def filter_images(images):
-    return [image for image in images if ':' in image and 'latest' not in image.split(':')[1]]
+    return normalize_images(images)
 
 
-def get_all_images_with_tags(base_path):
-    all_images = set()
-    print(f"Scanning local repositories in {base_path}*")
-    repositories = scan_repositories(base_path)
+def record_repository(catalog, scan_state, repo_path):
+    if catalog is not None:
+        catalog.update_repository(repo_path, scan_state.get_repository(repo_path), get_repository_origin(repo_path))
 
-    for repo_path in repositories:
-        print(f"Processing repository: {repo_path}")
-        images = process_repository_images(repo_path)
-        all_images.update(images)
-        if images:
-            print(f"Found images in {repo_path}: {images}\n")
-        else:
-            print(f"No images found in {repo_path}.\n")
 
-    return filter_images(all_images)
+def report_repository_images(repo_path, images):
+    if images:
+        print(f"Found images in {repo_path}: {images}\n")
+    else:
+        print(f"No images found in {repo_path}.\n")
+
+
+_worker_parse_cache = None
+_worker_scan_state = None
+
 
+def _init_scan_worker(parse_cache_entries, scan_state_repositories):
+    global _worker_parse_cache, _worker_scan_state
+    _worker_parse_cache = ParseCache()
+    _worker_parse_cache.entries.update(parse_cache_entries)
+    _worker_scan_state = ScanState()
+    _worker_scan_state.repositories.update(scan_state_repositories)
 
-def get_remote_repo_images_with_tags(repo_urls):
+
+def _scan_repository_job(repo_path, scan_mode, ignore_patterns, use_gitignore=False):
+    parse_hits, parse_misses = _worker_parse_cache.hits, _worker_parse_cache.misses
+    state_hits, state_misses = _worker_scan_state.hits, _worker_scan_state.misses
+    # Worker processes run one job at a time, so the metrics collected since the reset belong to this job.
+    metrics.reset()
+    output = io.StringIO()
+    images = set()
+
+    with contextlib.redirect_stdout(output):
+        try:
+            images = process_repository_images(repo_path, scan_mode, _worker_parse_cache, _worker_scan_state,
+                                               ignore_patterns, use_gitignore)
+        except Exception:
+            print(f"Failed to process repository {repo_path}:\n{traceback.format_exc()}")
+
+    return {
+        'images': images,
+        'output': output.getvalue(),
+        'parse_cache_entries': _worker_parse_cache.drain_added(),
+        'parse_cache_hits': _worker_parse_cache.hits - parse_hits,
+        'parse_cache_misses': _worker_parse_cache.misses - parse_misses,
+        'branches': _worker_scan_state.get_repository(repo_path),
+        'scan_state_hits': _worker_scan_state.hits - state_hits,
+        'scan_state_misses': _worker_scan_state.misses - state_misses,
+        'metrics': metrics.snapshot(),
+    }
+
+
+def process_repositories_in_pool(repositories, scan_mode, parse_cache, scan_state, jobs, ignore_patterns=(),
+                                 on_images=None, catalog=None, use_gitignore=False):
     all_images = set()
-    print(f"Cloning remote repositories: {repo_urls}...")
-    repositories = scan_remote_repos(repo_urls)
 
-    for repo_path in repositories:
+    def handle(future, repo_path):
         print(f"Processing repository: {repo_path}")
-        images = process_repository_images(repo_path)
-        all_images.update(images)
-        if images:
-            print(f"Found images in {repo_path}: {images}\n")
-        else:
-            print(f"No images found in {repo_path}.\n")
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Failed to process repository {repo_path}: {e}\n")
+            return
+
+        print(result['output'], end='')
+        parse_cache.merge(result['parse_cache_entries'], result['parse_cache_hits'],
+                          result['parse_cache_misses'])
+        scan_state.merge_counters(result['scan_state_hits'], result['scan_state_misses'])
+        metrics.merge(result['metrics'])
+        if result['branches'] is not None:
+            scan_state.update_repository(repo_path, result['branches'])
+        record_repository(catalog, scan_state, repo_path)
+
+        all_images.update(result['images'])
+        report_repository_images(repo_path, result['images'])
+        if on_images is not None:
+            on_images(filter_images(result['images']))
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_scan_worker,
+                             initargs=(parse_cache.entries, scan_state.repositories)) as executor:
+        # repositories may be a lazy walk of --base_path: only a window of jobs are submitted ahead, and
+        # finished repositories are handled while the walk goes on instead of after it.
+        futures = {}
+        for repo_path in repositories:
+            future = executor.submit(_scan_repository_job, repo_path, scan_mode, ignore_patterns, use_gitignore)
+            futures[future] = repo_path
+            if len(futures) >= POOL_SUBMIT_WINDOW * jobs:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    handle(future, futures.pop(future))
+
+        for future in as_completed(futures):
+            handle(future, futures[future])
+
+    return all_images
 
+
+def process_repositories(repositories, scan_mode=TREE_SCAN_MODE, parse_cache=None, scan_state=None, jobs=1,
+                         ignore_patterns=(), on_images=None, catalog=None, use_gitignore=False):
+    # on_images, if given, receives the filtered images of every repository as soon as it is scanned;
+    # catalog, if given, gets the per-file images of every scanned branch.
+    parse_cache = parse_cache if parse_cache is not None else ParseCache()
+    scan_state = scan_state if scan_state is not None else ScanState()
+    # The caches may be reused by several scans (watch mode), so only this scan's counts are reported.
+    parse_hits, parse_misses = parse_cache.hits, parse_cache.misses
+    state_hits, state_misses = scan_state.hits, scan_state.misses
+
+    if jobs > 1:
+        all_images = process_repositories_in_pool(repositories, scan_mode, parse_cache, scan_state, jobs,
+                                                  ignore_patterns, on_images, catalog, use_gitignore)
+    else:
+        all_images = set()
+        for repo_path in repositories:
+            print(f"Processing repository: {repo_path}")
+            images = process_repository_images(repo_path, scan_mode, parse_cache, scan_state, ignore_patterns,
+                                               use_gitignore)
+            record_repository(catalog, scan_state, repo_path)
+            all_images.update(images)
+            report_repository_images(repo_path, images)
+            if on_images is not None:
+                on_images(filter_images(images))
+
+    print(f"Parse cache: {parse_cache.hits - parse_hits} hits, {parse_cache.misses - parse_misses} misses.")
+    print(f"Unchanged branches: {scan_state.hits - state_hits}, "
+          f"rescanned branches: {scan_state.misses - state_misses}.")
+    parse_cache.save()
+    scan_state.save()
     return filter_images(all_images)
+
+
+def get_all_images_with_tags(base_path, scan_mode=TREE_SCAN_MODE, parse_cache=None, scan_state=None, jobs=1,
+                             ignore_patterns=(), use_gitignore=False, nested_repositories=False, on_images=None,
+                             catalog=None):
+    print(f"Scanning local repositories in {base_path}*")
+    repositories = scan_repositories(base_path, ignore_patterns, use_gitignore, nested_repositories)
+    return process_repositories(repositories, scan_mode, parse_cache, scan_state, jobs, ignore_patterns, on_images,
+                                catalog, use_gitignore)
+
+
+def get_remote_repo_images_with_tags(repo_urls, scan_mode=TREE_SCAN_MODE, parse_cache=None, scan_state=None, jobs=1,
+                                     mirror_directory=DEFAULT_MIRROR_DIRECTORY, clone_jobs=DEFAULT_CLONE_JOBS,
+                                     on_images=None, catalog=None):
+    if scan_mode != TREE_SCAN_MODE:
+        raise GitRepositoryError("Remote repositories are kept as bare mirrors and can only be scanned in tree mode.")
+
+    print(f"Syncing remote repositories: {repo_urls}...")
+    repositories = scan_remote_repos(repo_urls, mirror_directory, clone_jobs)
+    return process_repositories(repositories, scan_mode, parse_cache, scan_state, jobs, on_images=on_images,
+                                catalog=catalog)
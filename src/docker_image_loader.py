@@ -1,9 +1,39 @@
 import os
+import time
+import tarfile
+import threading
 import subprocess
-from .exception import DockerDaemonNotRunningError
+from concurrent.futures import ThreadPoolExecutor
+from .exception import DockerDaemonNotRunningError, DockerEngineError
+from .docker_engine_client import get_docker_client
+from .layer_store import save_image_to_layer_store
+from .image_stream import write_image_archive, ARCHIVE_EXTENSIONS, NO_COMPRESSION
+from .archive_hash import ArchiveHashIndex
+from .metrics import metrics
 
+DEFAULT_PULL_JOBS = 4
+DEFAULT_SAVE_JOBS = 2
+DEFAULT_PULL_RETRIES = 3
+PULL_RETRY_DELAY = 2
+
+ARCHIVE_EXPORT_MODE = 'archive'
+LAYERS_EXPORT_MODE = 'layers'
+EXPORT_MODES = (ARCHIVE_EXPORT_MODE, LAYERS_EXPORT_MODE)
+
+PERMANENT_PULL_ERRORS = (
+    "manifest unknown",
+    "not found",
+    "unauthorized",
+    "denied",
+    "invalid reference format",
+)
+AUTH_PULL_ERRORS = ("unauthorized", "denied", "authentication required")
+
+
+def is_docker_running(client=None):
+    if client is not None:
+        return client.ping()
 
-def is_docker_running():
     try:
         subprocess.run(["docker", "ps"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         return True
@@ -11,7 +41,27 @@ def is_docker_running():
         return False
 
 
-def image_exists(image):
+def list_local_images(client=None):
+    if client is not None:
+        return client.list_images()
+
+    try:
+        result = subprocess.run(
+            ["docker", "images", "--format", "{{.Repository}}:{{.Tag}}"],
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+    except subprocess.CalledProcessError:
+        return set()
+    return {line for line in result.stdout.splitlines() if '<none>' not in line}
+
+
+def image_exists(image, client=None):
+    if client is not None:
+        try:
+            return client.image_exists(image)
+        except DockerEngineError:
+            return False
+
     try:
         subprocess.run(["docker", "inspect", image], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         return True
@@ -19,43 +69,214 @@ def image_exists(image):
         return False
 
 
-def pull_docker_image(image):
+def get_image_id(image, client=None):
+    if client is not None:
+        return client.inspect_image(image)['Id']
+
+    try:
+        result = subprocess.run(["docker", "inspect", "--format", "{{.Id}}", image],
+                                check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except subprocess.CalledProcessError as e:
+        raise DockerEngineError(e.stderr.strip() or str(e))
+    return result.stdout.strip()
+
+
+class ResolvedImages:
+    # Image ID -> the first reference that resolved to it; later references with the same ID are not saved again.
+    def __init__(self):
+        self.images = {}
+        self._lock = threading.Lock()
+
+    def claim(self, image_id, image):
+        with self._lock:
+            return self.images.setdefault(image_id, image)
+
+
+def is_transient_pull_error(error):
+    error = error.lower()
+    return not any(message in error for message in PERMANENT_PULL_ERRORS)
+
+
+def is_auth_pull_error(error):
+    error = error.lower()
+    return any(message in error for message in AUTH_PULL_ERRORS)
+
+
+def run_cli_pull(image):
     try:
         subprocess.run(["docker", "pull", image], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    except subprocess.CalledProcessError as e:
+        error = e.stderr.decode('utf-8', errors='replace').strip() if e.stderr else str(e)
+        raise DockerEngineError(error or str(e))
+
+
+def run_docker_pull(image, client=None):
+    if client is None:
+        run_cli_pull(image)
+        return
+
+    try:
+        client.pull_image(image)
+    except DockerEngineError as e:
+        # Credentials the API header could not be built from (unknown helpers, contexts) still work in the CLI.
+        if not is_auth_pull_error(str(e)):
+            raise
+        print(f"Pull of {image} through the Docker Engine API was not authorized, retrying with docker CLI")
+        try:
+            run_cli_pull(image)
+        except OSError:
+            raise e
+
+
+def pull_docker_image(image, retries=0, delay=PULL_RETRY_DELAY, client=None, errors=None):
+    # errors, if given, receives the message of every failed attempt.
+    for attempt in range(retries + 1):
+        try:
+            run_docker_pull(image, client)
+            return True
+        except DockerEngineError as e:
+            if errors is not None:
+                errors.append(str(e))
+            if attempt == retries or not is_transient_pull_error(str(e)):
+                return False
+
+            wait = delay * 2 ** attempt
+            print(f"Pull of {image} failed ({e}). Retrying in {wait}s...")
+            time.sleep(wait)
+    return False
+
+
+def get_image_archive_path(image, directory, compression=NO_COMPRESSION):
+    image_name = image.replace("/", "_").replace(":", "_")
+    return os.path.join(directory, image_name + ARCHIVE_EXTENSIONS[compression])
 
 
-def save_docker_image(image, directory):
-    if not image_exists(image):
+def save_docker_image(image, directory, pull_retries=0, pull_semaphore=None, save_semaphore=None, client=None,
+                      export_mode=ARCHIVE_EXPORT_MODE, compression=NO_COMPRESSION, compression_level=None):
+    result = process_docker_image(image, directory, pull_retries, pull_semaphore, save_semaphore, client,
+                                  export_mode=export_mode, compression=compression,
+                                  compression_level=compression_level)
+    return result['status'] == 'saved'
+
+
+def export_docker_image(image, directory, client=None, export_mode=ARCHIVE_EXPORT_MODE, compression=NO_COMPRESSION,
+                        compression_level=None, hash_index=None):
+    # Returns the number of bytes exported from Docker when it is known.
+    if export_mode == LAYERS_EXPORT_MODE:
+        save_image_to_layer_store(image, directory, client)
+        return 0
+
+    file_name = get_image_archive_path(image, directory, compression)
+    archive = write_image_archive(image, file_name, compression, compression_level, client)
+    if hash_index is not None:
+        # The content hash was computed while writing, so the uploader never has to re-read the archive.
+        hash_index.record(file_name, archive['content_hash'])
+    print(f"Saved {image} to {file_name} ({archive['size']} bytes uncompressed, {archive['content_hash']})")
+    return archive['size']
+
+
+def process_docker_image(image, directory, pull_retries=0, pull_semaphore=None, save_semaphore=None, client=None,
+                         local_images=None, export_mode=ARCHIVE_EXPORT_MODE, compression=NO_COMPRESSION,
+                         compression_level=None, exporter=None, hash_index=None, resolved_images=None):
+    pull_semaphore = pull_semaphore or threading.BoundedSemaphore(1)
+    save_semaphore = save_semaphore or threading.BoundedSemaphore(1)
+    result = {'image': image, 'status': 'saved', 'pull_seconds': 0.0, 'save_seconds': 0.0}
+
+    exists = image in local_images if local_images is not None else False
+    if not exists and not image_exists(image, client):
         print(f"Image {image} not found locally. Attempting to pull from Docker Hub...")
-        if not pull_docker_image(image):
+        with pull_semaphore:
+            started = time.monotonic()
+            errors = []
+            pulled = pull_docker_image(image, pull_retries, client=client, errors=errors)
+            result['pull_seconds'] = time.monotonic() - started
+        metrics.add('docker.pull', result['pull_seconds'])
+        if not pulled:
             print(f"Failed to pull image {image} from Docker Hub.")
-            return False
+            result['status'] = 'pull failed'
+            # A missing image or denied access will not change by pulling again later.
+            result['permanent'] = bool(errors) and not is_transient_pull_error(errors[-1])
+            metrics.increment('images.pull failed')
+            return result
 
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    if resolved_images is not None:
+        try:
+            image_id = get_image_id(image, client)
+        except (DockerEngineError, KeyError) as e:
+            print(f"Failed to resolve the ID of {image}: {e}")
+            image_id = None
+        owner = resolved_images.claim(image_id, image) if image_id else image
+        if owner != image:
+            print(f"Image {image} has the same ID as {owner}. Skipping save.")
+            result['status'] = f"duplicate of {owner}"
+            metrics.increment('images.duplicate')
+            return result
 
-    image_name = image.replace("/", "_").replace(":", "_")
-    file_name = os.path.join(directory, image_name + ".tar")
+    os.makedirs(directory, exist_ok=True)
+
+    with save_semaphore:
+        started = time.monotonic()
+        size = 0
+        try:
+            if exporter is not None:
+                if not exporter(image):
+                    result['status'] = 'save failed'
+            else:
+                size = export_docker_image(image, directory, client, export_mode, compression, compression_level,
+                                           hash_index)
+        except (DockerEngineError, OSError, tarfile.TarError) as e:
+            print(f"Failed to save Docker image {image} to {directory}. Error: {e}")
+            result['status'] = 'save failed'
+        result['save_seconds'] = time.monotonic() - started
+        metrics.add('docker.save', result['save_seconds'], size)
+
+    metrics.increment(f"images.{result['status']}")
+    return result
 
-    try:
-        subprocess.run(["docker", "save", "-o", file_name, image], check=True)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to save Docker image {image} to {file_name}. Error: {e}")
-        return False
 
+def print_save_summary(results):
+    print("Docker image save summary:")
+    for result in results:
+        print(f"  {result['image']}: {result['status']} "
+              f"(pull {result['pull_seconds']:.1f}s, save {result['save_seconds']:.1f}s)")
 
-def save_docker_images(images, directory):
-    if not is_docker_running():
+    saved = sum(1 for result in results if result['status'] == 'saved')
+    print(f"Saved {saved} of {len(results)} images.\n")
+
+
+def save_docker_images(images, directory, pull_jobs=DEFAULT_PULL_JOBS, save_jobs=DEFAULT_SAVE_JOBS,
+                       pull_retries=DEFAULT_PULL_RETRIES, client=None, check_daemon=True,
+                       export_mode=ARCHIVE_EXPORT_MODE, compression=NO_COMPRESSION, compression_level=None,
+                       exporter=None, resolve_ids=False):
+    client = client if client is not None else get_docker_client()
+    if check_daemon and not is_docker_running(client):
         raise DockerDaemonNotRunningError("Docker daemon is not running. Please start Docker and try again.")
 
-    for image in images:
+    # One listing call instead of an inspect per image; images missing from it are still inspected.
+    local_images = list_local_images(client)
+    os.makedirs(directory, exist_ok=True)
+    hash_index = ArchiveHashIndex(directory)
+    resolved_images = ResolvedImages() if resolve_ids else None
+
+    pull_semaphore = threading.BoundedSemaphore(max(1, pull_jobs))
+    save_semaphore = threading.BoundedSemaphore(max(1, save_jobs))
+
+    def save(image):
         print(f"Starting to save Docker image {image} as tar archive")
-        success = save_docker_image(image, directory)
-        if success:
+        result = process_docker_image(image, directory, pull_retries, pull_semaphore, save_semaphore, client,
+                                      local_images, export_mode, compression, compression_level, exporter,
+                                      hash_index, resolved_images)
+        if result['status'] == 'saved':
             print(f"Successfully saved {image}.\n")
         else:
             print(f"Failed to save {image}.\n")
+        return result
+
+    # Enough workers for every pull and save slot to be busy at the same time.
+    with ThreadPoolExecutor(max_workers=max(1, pull_jobs) + max(1, save_jobs)) as executor:
+        results = list(executor.map(save, images))
+
+    hash_index.save()
+
+    print_save_summary(results)
+    return results
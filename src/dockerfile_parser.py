@@ -0,0 +1,196 @@
+import re
+
+DEFAULT_ESCAPE = '\\'
+DIRECTIVE_PATTERN = re.compile(r'#\s*([a-zA-Z][a-zA-Z0-9_-]*)\s*=\s*(.*?)\s*$')
+# As in BuildKit, only a whole unquoted shell word such as <<EOF, <<-"EOF" or 3<<EOF opens a heredoc,
+# so here-strings (<<<word) and arithmetic shifts ($((1<<2))) do not.
+HEREDOC_PATTERN = re.compile(r'^\d*<<(-?)([^<]+)$')
+SHELL_WORD_PATTERN = re.compile(r'(?:[^\s\'"]+|\'[^\']*\'|"(?:\\.|[^"\\])*")+')
+VARIABLE_PATTERN = re.compile(r'\$(?:\{([A-Za-z_][A-Za-z0-9_]*)(?:(:?[-+])([^}]*))?\}|([A-Za-z_][A-Za-z0-9_]*))')
+HEREDOC_INSTRUCTIONS = ('RUN', 'COPY', 'ADD')
+SCRATCH_IMAGE = 'scratch'
+PARSED_INSTRUCTIONS = {'ARG', 'FROM', 'COPY', 'ADD', 'RUN'}
+
+
+def read_directives(lines):
+    # Parser directives ("# escape=`", "# syntax=...") are only recognised before the first other line.
+    directives = {}
+    for index, line in enumerate(lines):
+        match = DIRECTIVE_PATTERN.match(line.strip())
+        if not match or match.group(1).lower() in directives:
+            return directives, index
+        directives[match.group(1).lower()] = match.group(2)
+    return directives, len(lines)
+
+
+def get_heredocs(arguments):
+    # Returns (strip leading tabs, terminator) for every heredoc the instruction opens, in order.
+    heredocs = []
+    for word in SHELL_WORD_PATTERN.findall(arguments):
+        match = HEREDOC_PATTERN.match(word)
+        if match:
+            terminator = match.group(2).replace('"', '').replace("'", '')
+            if terminator:
+                heredocs.append((bool(match.group(1)), terminator))
+    return heredocs
+
+
+def iter_instructions(content, keywords=None):
+    # Yields (INSTRUCTION, arguments) with comments dropped and continuation lines joined.
+    # Instructions outside keywords are still consumed, but their arguments are never assembled.
+    # Dockerfiles saved by Windows editors often start with a UTF-8 byte order mark; BuildKit ignores it.
+    if content.startswith('\ufeff'):
+        content = content[1:]
+    lines = content.splitlines()
+    directives, start = read_directives(lines)
+    escape = directives.get('escape', DEFAULT_ESCAPE)[:1] or DEFAULT_ESCAPE
+
+    keyword = None
+    wanted = False
+    parts = []
+    heredocs = []
+    for line in lines[start:]:
+        if heredocs:
+            # Heredoc bodies are instruction input, so a "FROM" line inside one is not an instruction.
+            strip_tabs, terminator = heredocs[0]
+            if (line.lstrip('\t') if strip_tabs else line) == terminator:
+                heredocs.pop(0)
+            continue
+
+        stripped = line.strip()
+        if not stripped or stripped[0] == '#':
+            continue
+
+        continued = stripped[-1] == escape
+        if continued:
+            stripped = stripped[:-1]
+
+        if keyword is None:
+            words = stripped.split(None, 1)
+            keyword = words[0].upper()
+            stripped = words[1] if len(words) > 1 else ''
+            wanted = keywords is None or keyword in keywords
+            if not wanted and keyword not in HEREDOC_INSTRUCTIONS:
+                keyword = '' if continued else None
+                continue
+
+        if wanted or keyword in HEREDOC_INSTRUCTIONS:
+            parts.append(stripped)
+        if continued:
+            continue
+
+        if keyword:
+            arguments = ' '.join(parts).strip() if len(parts) > 1 else stripped.strip()
+            if keyword in HEREDOC_INSTRUCTIONS and '<<' in arguments:
+                heredocs = get_heredocs(arguments)
+            if wanted:
+                yield keyword, arguments
+        keyword = None
+        parts = []
+
+    if keyword and wanted:
+        yield keyword, ' '.join(parts).strip()
+
+
+def expand_variables(value, variables):
+    # Unknown variables are kept as written, so the reference is later rejected as unresolved
+    # instead of silently collapsing to a different image.
+    def replace(match):
+        name = match.group(1) or match.group(4)
+        operator, word = match.group(2), match.group(3)
+        current = variables.get(name)
+        if operator in (':-', '-'):
+            if current is None or (operator == ':-' and current == ''):
+                return expand_variables(word, variables)
+            return current
+        if operator in (':+', '+'):
+            if current is None or (operator == ':+' and current == ''):
+                return ''
+            return expand_variables(word, variables)
+        return match.group(0) if current is None else current
+
+    return VARIABLE_PATTERN.sub(replace, value) if '$' in value else value
+
+
+def unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+    return value
+
+
+def parse_arg(arguments, variables):
+    # "ARG NAME", "ARG NAME=value" or several of them on one line.
+    declared = {}
+    for token in arguments.split():
+        name, separator, default = token.partition('=')
+        declared[name] = expand_variables(unquote(default), variables) if separator else None
+    return declared
+
+
+def split_flags(arguments):
+    flags = {}
+    tokens = arguments.split()
+    while tokens and tokens[0].startswith('--'):
+        name, _, value = tokens.pop(0)[2:].partition('=')
+        flags.setdefault(name.lower(), []).append(value)
+    return flags, tokens
+
+
+def get_mount_sources(values):
+    sources = []
+    for value in values:
+        for option in value.split(','):
+            key, _, source = option.partition('=')
+            if key.strip().lower() == 'from' and source:
+                sources.append(source.strip())
+    return sources
+
+
+def parse_dockerfile_images(content, build_args=None):
+    # build_args override the defaults of declared ARGs, as `docker build --build-arg` does.
+    build_args = build_args or {}
+    images = []
+    stages = set()
+    global_args = {}
+    stage_args = None
+
+    def add_image(reference, variables):
+        reference = expand_variables(unquote(reference), variables)
+        if not reference or reference.isdigit() or reference.lower() in stages:
+            return
+        if reference.lower() == SCRATCH_IMAGE:
+            return
+        images.append(reference)
+
+    for instruction, arguments in iter_instructions(content, PARSED_INSTRUCTIONS):
+        if instruction == 'ARG':
+            if stage_args is None:
+                # Only ARGs declared before the first FROM can be used in FROM lines.
+                for name, value in parse_arg(arguments, global_args).items():
+                    value = build_args.get(name, value)
+                    if value is not None:
+                        global_args[name] = value
+            else:
+                for name, value in parse_arg(arguments, stage_args).items():
+                    # A bare "ARG NAME" inside a stage brings the global default into scope.
+                    if name in build_args:
+                        value = build_args[name]
+                    stage_args[name] = value if value is not None else global_args.get(name)
+                    if stage_args[name] is None:
+                        del stage_args[name]
+
+        elif instruction == 'FROM':
+            _, tokens = split_flags(arguments)
+            if not tokens:
+                continue
+            add_image(tokens[0], global_args)
+            if len(tokens) >= 3 and tokens[1].lower() == 'as':
+                stages.add(tokens[2].lower())
+            stage_args = {}
+
+        elif stage_args is not None and arguments.startswith('--'):
+            flags, _ = split_flags(arguments)
+            for reference in flags.get('from', []) + get_mount_sources(flags.get('mount', [])):
+                add_image(reference, stage_args)
+
+    return list(dict.fromkeys(images))
@@ -16,3 +16,15 @@ class InvalidGitRepository(GitRepositoryError):
 
 class BranchCheckoutError(GitRepositoryError):
     pass
+
+
+class DockerEngineError(DockerImageCollectorError):
+    pass
+
+
+class YandexDiskError(DockerImageCollectorError):
+    pass
+
+
+class TransientYandexDiskError(YandexDiskError):
+    pass
@@ -0,0 +1,160 @@
+import os
+import re
+import fnmatch
+
+GIT_DIRECTORY = '.git'
+GITIGNORE_FILE = '.gitignore'
+
+
+def compile_gitignore_pattern(pattern):
+    # fnmatch does not know gitignore's "**": a leading "**/" matches in every directory, "/**/" matches
+    # zero or more directories and a trailing "/**" everything inside. "*" and "?" never match "/".
+    regex = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        at_segment_start = index == 0 or pattern[index - 1] == '/'
+        if at_segment_start and pattern.startswith('**/', index):
+            regex.append('(?:.*/)?')
+            index += 3
+        elif at_segment_start and pattern.startswith('**', index) and index + 2 == len(pattern):
+            regex.append('.*')
+            index += 2
+        elif char == '*':
+            regex.append('[^/]*')
+            while index < len(pattern) and pattern[index] == '*':
+                index += 1
+        elif char == '?':
+            regex.append('[^/]')
+            index += 1
+        elif char == '[' and ']' in pattern[index + 2:]:
+            end = pattern.index(']', index + 2)
+            content = pattern[index + 1:end].replace('\\', '\\\\')
+            if content[0] in '!^':
+                content = '^' + content[1:]
+            regex.append(f"[{content}]")
+            index = end + 1
+        elif char == '\\' and index + 1 < len(pattern):
+            regex.append(re.escape(pattern[index + 1]))
+            index += 2
+        else:
+            regex.append(re.escape(char))
+            index += 1
+    return re.compile(''.join(regex))
+
+
+def parse_gitignore(path):
+    rules = []
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return rules
+
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        directory_only = line.endswith('/')
+        line = line.rstrip('/')
+        anchored = '/' in line
+        rules.append((compile_gitignore_pattern(line.lstrip('/')), negated, directory_only, anchored))
+    return rules
+
+
+def is_gitignored(relative_path, is_directory, gitignores):
+    ignored = False
+    for base, rules in gitignores:
+        path = os.path.relpath(relative_path, base) if base else relative_path
+        if path.startswith('..'):
+            continue
+        path = path.replace(os.sep, '/')
+        name = path.rsplit('/', 1)[-1]
+
+        for pattern, negated, directory_only, anchored in rules:
+            if directory_only and not is_directory:
+                continue
+            if pattern.fullmatch(path if anchored else name):
+                ignored = not negated
+    return ignored
+
+
+def is_repository(entries):
+    return any(entry.name == GIT_DIRECTORY for entry in entries)
+
+
+def walk(top, ignore_patterns=(), use_gitignore=False):
+    # Yields (directory, all entries, entries left after ignore rules) depth-first.
+    # Sending False back skips the subdirectories of the directory that was just yielded.
+    stack = [('', [])]
+    while stack:
+        relative_directory, gitignores = stack.pop()
+        directory = os.path.join(top, relative_directory) if relative_directory else top
+        try:
+            with os.scandir(directory) as iterator:
+                entries = list(iterator)
+        except OSError:
+            continue
+
+        if use_gitignore and any(entry.name == GITIGNORE_FILE for entry in entries):
+            gitignores = gitignores + [(relative_directory, parse_gitignore(os.path.join(directory, GITIGNORE_FILE)))]
+
+        kept = []
+        for entry in entries:
+            if entry.name == GIT_DIRECTORY:
+                continue
+            relative_path = os.path.join(relative_directory, entry.name)
+            if any(fnmatch.fnmatch(entry.name, pattern) or fnmatch.fnmatch(relative_path, pattern)
+                   for pattern in ignore_patterns):
+                continue
+            is_directory = entry.is_dir(follow_symlinks=False)
+            if gitignores and is_gitignored(relative_path, is_directory, gitignores):
+                continue
+            kept.append(entry)
+
+        descend = yield directory, entries, kept
+        if descend is False:
+            continue
+
+        for entry in reversed(kept):
+            if entry.is_dir(follow_symlinks=False):
+                stack.append((os.path.join(relative_directory, entry.name), gitignores))
+
+
+def iter_repositories(base_path, ignore_patterns=(), use_gitignore=False, nested=False):
+    walker = walk(base_path, ignore_patterns, use_gitignore)
+    descend = None
+    while True:
+        try:
+            directory, entries, _ = walker.send(descend)
+        except StopIteration:
+            return
+
+        descend = None
+        if is_repository(entries):
+            yield directory
+            if not nested:
+                descend = False
+
+
+def iter_files(top, ignore_patterns=(), use_gitignore=False, skip_nested_repositories=True):
+    walker = walk(top, ignore_patterns, use_gitignore)
+    descend = None
+    while True:
+        try:
+            directory, entries, kept = walker.send(descend)
+        except StopIteration:
+            return
+
+        descend = None
+        if skip_nested_repositories and directory != top and is_repository(entries):
+            descend = False
+            continue
+
+        for entry in kept:
+            if entry.is_file():
+                yield directory, entry.name
@@ -0,0 +1,122 @@
+import os
+import time
+import sqlite3
+from git import Repo
+from .image_reference import parse_image_reference, format_image_reference, normalize_images
+from .metrics import metrics
+from .repo_mirror import redact_url
+
+CATALOG_FILE_NAME = '.catalog.sqlite'
+CATALOG_VERSION = 2
+
+# One row per image reference found in a file of a branch. "canonical" is the full reference
+# ("docker.io/library/node:16") and "name" the same without tag and digest, so both
+# "node:16" and "node" can be answered from an index. Unparseable references keep NULL in both.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    repository TEXT NOT NULL,
+    origin TEXT,
+    branch TEXT NOT NULL,
+    commit_sha TEXT NOT NULL,
+    path TEXT NOT NULL,
+    image TEXT NOT NULL,
+    canonical TEXT,
+    name TEXT
+);
+CREATE INDEX IF NOT EXISTS images_canonical ON images (canonical);
+CREATE INDEX IF NOT EXISTS images_name ON images (name);
+CREATE INDEX IF NOT EXISTS images_repository ON images (repository, branch);
+CREATE TABLE IF NOT EXISTS repositories (
+    repository TEXT PRIMARY KEY,
+    origin TEXT,
+    scanned REAL NOT NULL
+);
+'''
+COLUMNS = ('repository', 'origin', 'branch', 'commit_sha', 'path', 'image', 'canonical')
+
+
+def get_repository_origin(repo_path):
+    # Local clones and remote mirrors both keep the source URL in remote.origin.url.
+    try:
+        return redact_url(Repo(repo_path).remotes.origin.url)
+    except Exception:
+        return None
+
+
+def get_canonical_names(image):
+    reference = parse_image_reference(image)
+    if reference is None:
+        return None, None
+    name = format_image_reference(reference._replace(tag=None, digest=None), familiar=False)
+    return format_image_reference(reference, familiar=False), name
+
+
+class ImageCatalog:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path)
+        version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != CATALOG_VERSION:
+            self._connection.executescript('DROP TABLE IF EXISTS images; DROP TABLE IF EXISTS repositories;')
+            self._connection.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    def update_repository(self, repo_path, branches, origin=None):
+        # branches is the scan state entry of the repository: {branch: {'commit', 'images', 'files'}}.
+        repository = os.path.abspath(repo_path)
+        rows = []
+        for branch, entry in (branches or {}).items():
+            for path, images in entry.get('files', {}).items():
+                for image in images:
+                    rows.append((repository, origin, branch, entry['commit'], path, image,
+                                 *get_canonical_names(image)))
+
+        with metrics.timer('catalog.update'), self._connection:
+            self._connection.execute('DELETE FROM images WHERE repository = ?', (repository,))
+            self._connection.executemany('INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._connection.execute('INSERT OR REPLACE INTO repositories VALUES (?, ?, ?)',
+                                     (repository, origin, time.time()))
+
+    def query(self, image=None, repository=None):
+        # image is matched on its canonical form, so "nginx:1.25" also finds "docker.io/library/nginx:1.25";
+        # without a tag or digest every tag of the image matches. repository may contain "*" wildcards.
+        conditions, params = [], []
+        if image:
+            reference = parse_image_reference(image)
+            if reference is None:
+                conditions.append('image = ?')
+                params.append(image)
+            elif reference.tag is None and reference.digest is None:
+                conditions.append('name = ?')
+                params.append(format_image_reference(reference, familiar=False))
+            else:
+                conditions.append('canonical = ?')
+                params.append(format_image_reference(reference, familiar=False))
+        if repository:
+            conditions.append('(repository LIKE ? OR origin LIKE ?)')
+            params.extend([repository.replace('*', '%')] * 2)
+
+        sql = f"SELECT {', '.join(COLUMNS)} FROM images"
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY repository, branch, path, image'
+
+        with metrics.timer('catalog.query'):
+            return [dict(zip(COLUMNS, row)) for row in self._connection.execute(sql, params)]
+
+    def list_images(self, repository=None):
+        # The image list a save or upload run would have produced from the last scan of these repositories.
+        sql = 'SELECT DISTINCT image FROM images'
+        params = []
+        if repository:
+            sql += ' WHERE repository LIKE ? OR origin LIKE ?'
+            params = [repository.replace('*', '%')] * 2
+        images = [row[0] for row in self._connection.execute(sql + ' ORDER BY image', params)]
+        return normalize_images(images)
@@ -0,0 +1,84 @@
+import re
+from collections import namedtuple
+
+DEFAULT_REGISTRY = 'docker.io'
+OFFICIAL_NAMESPACE = 'library'
+DOCKER_HUB_ALIASES = {'docker.io', 'index.docker.io', 'registry-1.docker.io', 'registry.hub.docker.com'}
+
+PATH_COMPONENT_PATTERN = re.compile(r'[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*')
+TAG_PATTERN = re.compile(r'\w[\w.-]{0,127}')
+DIGEST_PATTERN = re.compile(r'[a-z0-9]+(?:[.+_-][a-z0-9]+)*:[0-9a-fA-F]{32,}')
+REGISTRY_PATTERN = re.compile(r'(?:[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)*|\[[0-9a-fA-F:]+\])(?::[0-9]+)?')
+UNRESOLVED_MARKERS = ('$', '{{', '}}')
+
+ImageReference = namedtuple('ImageReference', ['registry', 'repository', 'tag', 'digest'])
+
+
+def parse_image_reference(image):
+    # Returns None for anything `docker pull` would reject, including unresolved template placeholders.
+    image = image.strip()
+    if not image or any(marker in image for marker in UNRESOLVED_MARKERS):
+        return None
+
+    name, _, digest = image.partition('@')
+    if digest and not DIGEST_PATTERN.fullmatch(digest):
+        return None
+
+    # A tag can only follow the last path component; a colon before it belongs to a registry port.
+    tag = None
+    slash = name.rfind('/')
+    colon = name.rfind(':')
+    if colon > slash:
+        name, tag = name[:colon], name[colon + 1:]
+        if not TAG_PATTERN.fullmatch(tag):
+            return None
+
+    registry = None
+    first, separator, rest = name.partition('/')
+    if separator and ('.' in first or ':' in first or first == 'localhost' or first != first.lower()):
+        if not REGISTRY_PATTERN.fullmatch(first):
+            return None
+        registry, name = first, rest
+
+    if not name or not all(PATH_COMPONENT_PATTERN.fullmatch(part) for part in name.split('/')):
+        return None
+
+    if registry is None or registry in DOCKER_HUB_ALIASES:
+        registry = DEFAULT_REGISTRY
+        if '/' not in name:
+            name = f"{OFFICIAL_NAMESPACE}/{name}"
+
+    return ImageReference(registry, name, tag, digest or None)
+
+
+def format_image_reference(reference, familiar=True):
+    # The familiar form ("nginx:1.25") is what docker prints and what archive names are built from;
+    # the full form ("docker.io/library/nginx:1.25") is unique per image and used for deduplication.
+    registry, repository, tag, digest = reference
+    name = f"{registry}/{repository}"
+    if familiar and registry == DEFAULT_REGISTRY:
+        name = repository[len(OFFICIAL_NAMESPACE) + 1:] if repository.startswith(f"{OFFICIAL_NAMESPACE}/") \
+            else repository
+    if tag:
+        name = f"{name}:{tag}"
+    if digest:
+        name = f"{name}@{digest}"
+    return name
+
+
+def is_pinned(reference):
+    # Images without a tag or with a moving "latest" tag would be saved with unpredictable content.
+    if reference.digest:
+        return True
+    return reference.tag is not None and 'latest' not in reference.tag
+
+
+def normalize_images(images):
+    # Returns familiar names of the pinned images, one per canonical reference, in input order.
+    normalized = {}
+    for image in images:
+        reference = parse_image_reference(image)
+        if reference is None or not is_pinned(reference):
+            continue
+        normalized.setdefault(format_image_reference(reference, familiar=False), format_image_reference(reference))
+    return list(normalized.values())
@@ -0,0 +1,130 @@
+import io
+import os
+import zlib
+import subprocess
+from contextlib import contextmanager
+from .exception import DockerEngineError
+from .archive_hash import TarContentHasher, zstandard
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+NO_COMPRESSION = 'none'
+GZIP_COMPRESSION = 'gzip'
+ZSTD_COMPRESSION = 'zstd'
+COMPRESSIONS = (NO_COMPRESSION, GZIP_COMPRESSION, ZSTD_COMPRESSION)
+ARCHIVE_EXTENSIONS = {
+    NO_COMPRESSION: '.tar',
+    GZIP_COMPRESSION: '.tar.gz',
+    ZSTD_COMPRESSION: '.tar.zst',
+}
+DEFAULT_COMPRESSION_LEVELS = {
+    GZIP_COMPRESSION: 6,
+    ZSTD_COMPRESSION: 3,
+}
+
+
+class ChunkStream(io.RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b''
+                return 0
+
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+@contextmanager
+def open_image_stream(image, client=None):
+    # Yields the `docker save` tar stream of the image as a binary file object.
+    if client is not None:
+        chunks = client.export_images([image])
+        try:
+            yield io.BufferedReader(ChunkStream(chunks), STREAM_CHUNK_SIZE)
+        finally:
+            chunks.close()
+        return
+
+    process = subprocess.Popen(["docker", "save", image], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        yield process.stdout
+        # Drain whatever the consumer did not read so that docker can exit.
+        while process.stdout.read(STREAM_CHUNK_SIZE):
+            pass
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        error = process.stderr.read().decode('utf-8', errors='replace').strip()
+        process.stderr.close()
+        process.wait()
+
+    if process.returncode != 0:
+        raise DockerEngineError(f"docker save {image} failed: {error}")
+
+
+def get_compressor(compression, level=None):
+    if compression == NO_COMPRESSION:
+        return None
+
+    level = DEFAULT_COMPRESSION_LEVELS[compression] if level is None else level
+    if compression == GZIP_COMPRESSION:
+        # wbits=31 produces a gzip container that `tar -xzf` and tarfile understand.
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    if zstandard is None:
+        raise DockerEngineError("zstd compression requires the 'zstandard' package.")
+    return zstandard.ZstdCompressor(level=level, threads=-1).compressobj()
+
+
+def iter_image_archive(image, compression=NO_COMPRESSION, level=None, client=None, result=None):
+    # Reads the image once, hashing the tar members and compressing the stream on the fly.
+    # The content hash is stored in `result['content_hash']` once the generator is exhausted.
+    hasher = TarContentHasher()
+    compressor = get_compressor(compression, level)
+    size = 0
+
+    with open_image_stream(image, client) as stream:
+        while chunk := stream.read(STREAM_CHUNK_SIZE):
+            hasher.update(chunk)
+            size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    if compressor is not None:
+        tail = compressor.flush()
+        if tail:
+            yield tail
+
+    if result is not None:
+        result['content_hash'] = hasher.hexdigest()
+        result['size'] = size
+
+
+def write_image_archive(image, file_name, compression=NO_COMPRESSION, level=None, client=None):
+    result = {}
+    tmp_name = f"{file_name}.tmp"
+    try:
+        with open(tmp_name, 'wb') as file:
+            for chunk in iter_image_archive(image, compression, level, client, result):
+                file.write(chunk)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+    os.replace(tmp_name, file_name)
+    return result
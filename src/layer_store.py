@@ -0,0 +1,110 @@
+import os
+import re
+import json
+import hashlib
+import tarfile
+import tempfile
+from .image_stream import open_image_stream, STREAM_CHUNK_SIZE
+
+BLOBS_DIRECTORY = os.path.join('blobs', 'sha256')
+IMAGES_DIRECTORY = 'images'
+OCI_BLOB_PATTERN = re.compile(r'^blobs/sha256/([0-9a-f]{64})$')
+
+
+def get_blob_path(directory, digest):
+    return os.path.join(directory, BLOBS_DIRECTORY, digest)
+
+
+def get_image_manifest_path(directory, image):
+    image_name = image.replace("/", "_").replace(":", "_")
+    return os.path.join(directory, IMAGES_DIRECTORY, image_name + ".json")
+
+
+def is_layer_store(directory):
+    return os.path.isdir(os.path.join(directory, BLOBS_DIRECTORY))
+
+
+def store_blob(directory, source):
+    blobs_directory = os.path.join(directory, BLOBS_DIRECTORY)
+    sha256 = hashlib.sha256()
+    size = 0
+
+    with tempfile.NamedTemporaryFile(dir=blobs_directory, prefix='.incoming-', delete=False) as tmp_file:
+        try:
+            while chunk := source.read(STREAM_CHUNK_SIZE):
+                sha256.update(chunk)
+                tmp_file.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            os.unlink(tmp_file.name)
+            raise
+
+    digest = sha256.hexdigest()
+    blob_path = get_blob_path(directory, digest)
+    if os.path.exists(blob_path):
+        os.unlink(tmp_file.name)
+        return digest, size, False
+
+    os.replace(tmp_file.name, blob_path)
+    return digest, size, True
+
+
+def save_image_to_layer_store(image, directory, client=None):
+    os.makedirs(os.path.join(directory, BLOBS_DIRECTORY), exist_ok=True)
+    os.makedirs(os.path.join(directory, IMAGES_DIRECTORY), exist_ok=True)
+
+    members = []
+    stored = reused = 0
+    with open_image_stream(image, client) as stream:
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                entry = {
+                    'name': member.name,
+                    'type': member.type.decode(),
+                    'mode': member.mode,
+                    'mtime': member.mtime,
+                    'linkname': member.linkname,
+                }
+
+                if member.isfile():
+                    # Docker 25+ already writes an OCI layout, so known blobs need not be hashed again.
+                    match = OCI_BLOB_PATTERN.match(member.name)
+                    if match and os.path.exists(get_blob_path(directory, match.group(1))):
+                        entry['digest'], entry['size'] = match.group(1), member.size
+                        reused += 1
+                    else:
+                        digest, size, created = store_blob(directory, tar.extractfile(member))
+                        entry['digest'], entry['size'] = digest, size
+                        stored, reused = stored + created, reused + (not created)
+
+                members.append(entry)
+
+    manifest_path = get_image_manifest_path(directory, image)
+    with open(f"{manifest_path}.tmp", 'w', encoding='utf-8') as file:
+        json.dump({'image': image, 'members': members}, file, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    print(f"Stored {image}: {stored} new blobs, {reused} already present.")
+    return manifest_path
+
+
+def restore_image_archive(directory, image, output_path):
+    with open(get_image_manifest_path(directory, image), 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+
+    with tarfile.open(output_path, 'w', format=tarfile.PAX_FORMAT) as tar:
+        for entry in manifest['members']:
+            member = tarfile.TarInfo(entry['name'])
+            member.type = entry['type'].encode()
+            member.mode = entry['mode']
+            member.mtime = entry['mtime']
+            member.linkname = entry['linkname']
+
+            if member.isfile():
+                member.size = entry['size']
+                with open(get_blob_path(directory, entry['digest']), 'rb') as blob:
+                    tar.addfile(member, blob)
+            else:
+                tar.addfile(member)
+
+    return output_path
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+REPORT_VERSION = 1
+CPROFILE_PROFILER = 'cprofile'
+PYINSTRUMENT_PROFILER = 'pyinstrument'
+PROFILERS = (CPROFILE_PROFILER, PYINSTRUMENT_PROFILER)
+PROFILE_PRINT_LIMIT = 30
+
+
+class Metrics:
+    # Process-wide timings, byte counts and counters. Stages are named "<area>.<step>" (for example
+    # "scan.repository" or "parse.dockerfile"); every stage keeps a count, total and max duration and bytes.
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, size=0):
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0}
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['bytes'] += size
+
+    def increment(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextmanager
+    def timer(self, stage, size=0):
+        # The yielded dict lets the timed block report the bytes it moved once it knows them.
+        record = {'bytes': size}
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.add(stage, time.perf_counter() - started, record['bytes'])
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'stages': {stage: dict(entry) for stage, entry in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+
+    def merge(self, snapshot):
+        # Combines the metrics a scan worker process collected for one job.
+        with self._lock:
+            for stage, other in snapshot.get('stages', {}).items():
+                entry = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0})
+                entry['count'] += other['count']
+                entry['seconds'] += other['seconds']
+                entry['max_seconds'] = max(entry['max_seconds'], other['max_seconds'])
+                entry['bytes'] += other['bytes']
+            for counter, value in snapshot.get('counters', {}).items():
+                self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def report(self, extra=None):
+        snapshot = self.snapshot()
+        for entry in snapshot['stages'].values():
+            if entry['bytes'] and entry['seconds']:
+                entry['bytes_per_second'] = entry['bytes'] / entry['seconds']
+        return {
+            'version': REPORT_VERSION,
+            'started': self.started,
+            'wall_seconds': time.time() - self.started,
+            **snapshot,
+            **(extra or {}),
+        }
+
+    def save_report(self, path, extra=None):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(extra), file, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+        print(f"Run report written to {path}")
+
+
+metrics = Metrics()
+
+
+def run_profiled(profiler, output, function, *args):
+    # cProfile output is a pstats file (or the top functions printed), pyinstrument output is an HTML page.
+    if profiler == CPROFILE_PROFILER:
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            if output:
+                profile.dump_stats(output)
+                print(f"cProfile statistics written to {output}")
+            else:
+                pstats.Stats(profile).sort_stats('cumulative').print_stats(PROFILE_PRINT_LIMIT)
+
+    if profiler == PYINSTRUMENT_PROFILER:
+        profile = pyinstrument.Profiler()
+        profile.start()
+        try:
+            return function(*args)
+        finally:
+            profile.stop()
+            if output:
+                with open(output, 'w', encoding='utf-8') as file:
+                    file.write(profile.output_html())
+                print(f"pyinstrument report written to {output}")
+            else:
+                print(profile.output_text(unicode=True))
+
+    return function(*args)
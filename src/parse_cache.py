@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+from .metrics import metrics
+
+# Bump whenever a parser starts returning different images for the same content,
+# so that on-disk caches written by older versions are discarded.
+PARSE_CACHE_VERSION = 6
+
+
+def git_blob_sha(data):
+    return hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest()
+
+
+class ParseCache:
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._added = {}
+
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def key(kind, sha, path=None):
+        return f"{kind}:{sha}" if path is None else f"{kind}:{sha}:{path}"
+
+    def contains(self, kind, sha, path=None):
+        return self.key(kind, sha, path) in self.entries
+
+    def get(self, kind, sha):
+        images = self.entries.get(self.key(kind, sha))
+        if images is None:
+            self.misses += 1
+            metrics.increment('parse_cache.misses')
+        else:
+            self.hits += 1
+            metrics.increment('parse_cache.hits')
+        return images
+
+    def put(self, kind, sha, images):
+        key = self.key(kind, sha)
+        self.entries[key] = self._added[key] = list(images)
+        self._dirty = True
+
+    def drain_added(self):
+        added, self._added = self._added, {}
+        return added
+
+    def merge(self, entries, hits=0, misses=0):
+        if entries:
+            self.entries.update(entries)
+            self._dirty = True
+        self.hits += hits
+        self.misses += misses
+
+    def get_or_parse(self, kind, sha, read_content, parse):
+        images = self.get(kind, sha)
+        if images is None:
+            with metrics.timer('parse.read') as timing:
+                content = read_content()
+                timing['bytes'] = len(content)
+            with metrics.timer(f"parse.{kind}", len(content)):
+                images = parse(content)
+            self.put(kind, sha, images)
+        return images
+
+    def get_or_resolve(self, kind, sha, path, get_dependency_sha, resolve):
+        # For files whose images also depend on other files of the tree (a compose file's .env, extended
+        # files and build Dockerfiles). Those are found relative to the file, so the entry is keyed by
+        # its path as well; it keeps the sha of every dependency, or None for files that did not exist,
+        # and is only used while all of them are unchanged.
+        key = self.key(kind, sha, path)
+        entry = self.entries.get(key)
+        if isinstance(entry, dict) and all(get_dependency_sha(path) == dependency_sha
+                                           for path, dependency_sha in entry['dependencies'].items()):
+            self.hits += 1
+            metrics.increment('parse_cache.hits')
+            return entry['images']
+
+        self.misses += 1
+        metrics.increment('parse_cache.misses')
+        with metrics.timer(f"parse.{kind}"):
+            images, dependencies = resolve()
+        self.entries[key] = self._added[key] = {
+            'images': list(images),
+            'dependencies': {path: get_dependency_sha(path) for path in dependencies},
+        }
+        self._dirty = True
+        return images
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read parse cache {self.path}: {e}. Starting with an empty cache.")
+            return
+
+        if data.get('version') == PARSE_CACHE_VERSION:
+            self.entries.update(data.get('entries', {}))
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'version': PARSE_CACHE_VERSION, 'entries': self.entries}, file)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
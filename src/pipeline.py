@@ -0,0 +1,184 @@
+import os
+import queue
+import threading
+import traceback
+from .docker_image_loader import process_docker_image, list_local_images, get_image_archive_path, \
+    print_save_summary, ResolvedImages, DEFAULT_PULL_JOBS, DEFAULT_SAVE_JOBS, DEFAULT_PULL_RETRIES
+from .image_stream import NO_COMPRESSION
+from .archive_hash import ArchiveHashIndex
+from .yandex_disk_uploader import RemoteManifest, upload_archive
+from .yandex_disk_client import DEFAULT_UPLOAD_JOBS, DEFAULT_UPLOAD_RETRIES
+
+DEFAULT_QUEUE_SIZE = 8
+FAILED_STATUSES = ('pull failed', 'save failed')
+
+
+def start_workers(count, target, name):
+    workers = [threading.Thread(target=target, name=f"{name}-{index}", daemon=True) for index in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+class ImagePipeline:
+    # Images flow submit -> pull/save workers -> upload workers through bounded queues, so a slow stage
+    # holds back the one before it instead of letting archives pile up on disk. The workers, the remote
+    # manifest and the hash index live as long as the pipeline, so watch mode reuses them on every cycle.
+
+    def __init__(self, directory, docker_client=None, pull_jobs=DEFAULT_PULL_JOBS, save_jobs=DEFAULT_SAVE_JOBS,
+                 pull_retries=DEFAULT_PULL_RETRIES, compression=NO_COMPRESSION, compression_level=None,
+                 yandex_disk_client=None, yandex_disk_directory=None, upload_jobs=DEFAULT_UPLOAD_JOBS,
+                 upload_retries=DEFAULT_UPLOAD_RETRIES, delete_uploaded=False, queue_size=DEFAULT_QUEUE_SIZE,
+                 resolve_ids=False):
+        self.directory = directory
+        self.docker_client = docker_client
+        self.pull_jobs = max(1, pull_jobs)
+        self.save_jobs = max(1, save_jobs)
+        self.pull_retries = pull_retries
+        self.compression = compression
+        self.compression_level = compression_level
+        self.yandex_disk_client = yandex_disk_client
+        self.yandex_disk_directory = yandex_disk_directory
+        self.upload_jobs = max(1, upload_jobs)
+        self.upload_retries = upload_retries
+        self.delete_uploaded = delete_uploaded
+        self.upload = yandex_disk_client is not None and bool(yandex_disk_directory)
+
+        self.image_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.upload_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.pull_semaphore = threading.BoundedSemaphore(self.pull_jobs)
+        self.save_semaphore = threading.BoundedSemaphore(self.save_jobs)
+        self.resolved_images = ResolvedImages() if resolve_ids else None
+
+        self.local_images = set()
+        self.hash_index = None
+        self.manifest = None
+        self.seen = set()
+        self.save_results = []
+        self.upload_results = []
+        self.failed_uploads = []
+        self._lock = threading.Lock()
+        self._save_workers = []
+        self._upload_workers = []
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.local_images = list_local_images(self.docker_client)
+        self.hash_index = ArchiveHashIndex(self.directory)
+        if self.upload:
+            self.yandex_disk_client.create_directory(self.yandex_disk_directory)
+            self.manifest = RemoteManifest(self.yandex_disk_directory, self.yandex_disk_client).load()
+
+        self._save_workers = start_workers(self.pull_jobs + self.save_jobs, self._save_worker, 'save')
+        if self.upload:
+            self._upload_workers = start_workers(self.upload_jobs, self._upload_worker, 'upload')
+        return self
+
+    def submit(self, images):
+        # Every image is processed once per pipeline; transient failures are forgotten so a later submit
+        # retries them, permanent pull failures (unknown image, access denied) are not.
+        for image in images:
+            with self._lock:
+                if image in self.seen:
+                    continue
+                self.seen.add(image)
+            self.image_queue.put(image)
+
+    def _save_worker(self):
+        while (image := self.image_queue.get()) is not None:
+            print(f"Starting to save Docker image {image} as tar archive")
+            try:
+                result = process_docker_image(image, self.directory, self.pull_retries, self.pull_semaphore,
+                                              self.save_semaphore, self.docker_client, self.local_images,
+                                              compression=self.compression,
+                                              compression_level=self.compression_level, hash_index=self.hash_index,
+                                              resolved_images=self.resolved_images)
+            except Exception:
+                print(f"Failed to save {image}:\n{traceback.format_exc()}")
+                result = {'image': image, 'status': 'save failed', 'pull_seconds': 0.0, 'save_seconds': 0.0}
+
+            with self._lock:
+                self.save_results.append(result)
+                if result['status'] in FAILED_STATUSES and not result.get('permanent'):
+                    self.seen.discard(image)
+            if result['status'] == 'saved' and self.upload:
+                self.upload_queue.put(get_image_archive_path(image, self.directory, self.compression))
+            self.image_queue.task_done()
+        self.image_queue.task_done()
+
+    def _upload_worker(self):
+        while (file_path := self.upload_queue.get()) is not None:
+            try:
+                status = upload_archive(file_path, self.yandex_disk_client, self.yandex_disk_directory,
+                                        self.manifest, self.hash_index, self.upload_retries, self.delete_uploaded)
+            except Exception:
+                print(f"Failed to upload {file_path}:\n{traceback.format_exc()}")
+                status = 'upload failed'
+            with self._lock:
+                self.upload_results.append((os.path.basename(file_path), status))
+                if status in ('hash failed', 'upload failed'):
+                    self.failed_uploads.append(file_path)
+            self.upload_queue.task_done()
+        self.upload_queue.task_done()
+
+    def retry_uploads(self):
+        # Archives whose upload failed stay on disk; they are queued again instead of being saved again.
+        with self._lock:
+            failed, self.failed_uploads = self.failed_uploads, []
+        for file_path in failed:
+            self.upload_queue.put(file_path)
+
+    def save_indexes(self):
+        self.hash_index.save()
+        if self.manifest is not None:
+            self.manifest.save()
+
+    def wait(self):
+        # Blocks until everything submitted so far is saved and uploaded; the workers keep running.
+        self.image_queue.join()
+        self.upload_queue.join()
+        self.save_indexes()
+
+    def stop(self):
+        # Shut the stages down in order, so every saved archive still reaches an upload worker.
+        for _ in self._save_workers:
+            self.image_queue.put(None)
+        for worker in self._save_workers:
+            worker.join()
+        for _ in self._upload_workers:
+            self.upload_queue.put(None)
+        for worker in self._upload_workers:
+            worker.join()
+        self.save_indexes()
+
+    def print_summary(self):
+        # Prints and clears the results collected since the previous summary.
+        with self._lock:
+            save_results, self.save_results = self.save_results, []
+            upload_results, self.upload_results = self.upload_results, []
+
+        print_save_summary(save_results)
+        if self.upload:
+            uploaded = sum(1 for _, status in upload_results if status in ('uploaded', 'skipped'))
+            print(f"Uploaded {uploaded} of {len(upload_results)} archives to Yandex.Disk.")
+
+
+def run_pipeline(scan, directory, docker_client=None, pull_jobs=DEFAULT_PULL_JOBS, save_jobs=DEFAULT_SAVE_JOBS,
+                 pull_retries=DEFAULT_PULL_RETRIES, compression=NO_COMPRESSION, compression_level=None,
+                 yandex_disk_client=None, yandex_disk_directory=None, upload_jobs=DEFAULT_UPLOAD_JOBS,
+                 upload_retries=DEFAULT_UPLOAD_RETRIES, delete_uploaded=False, queue_size=DEFAULT_QUEUE_SIZE,
+                 resolve_ids=False):
+    # scan(on_images) runs the repository scan and calls on_images with the images of every repository
+    # as soon as it is processed, so pulls, saves and uploads overlap with the scan.
+    pipeline = ImagePipeline(directory, docker_client, pull_jobs, save_jobs, pull_retries, compression,
+                             compression_level, yandex_disk_client, yandex_disk_directory, upload_jobs,
+                             upload_retries, delete_uploaded, queue_size, resolve_ids).start()
+
+    images = []
+    try:
+        images = scan(pipeline.submit)
+    finally:
+        pipeline.stop()
+
+    pipeline.print_summary()
+    return images
@@ -0,0 +1,71 @@
+import json
+import os
+from .parse_cache import PARSE_CACHE_VERSION
+from .metrics import metrics
+
+SCAN_STATE_FILE_NAME = '.scan_state.json'
+TREE_SCAN_MODE = 'tree'
+
+
+class ScanState:
+    def __init__(self, path=None, load=True):
+        self.path = path
+        self.repositories = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+
+        if load and path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def repo_key(repo_path):
+        return os.path.abspath(repo_path)
+
+    def get_branch(self, repo_path, branch, commit):
+        # Only tree scan results are reused; checkout scans are recorded for the catalog alone.
+        entry = self.repositories.get(self.repo_key(repo_path), {}).get(branch)
+        if entry and entry['commit'] == commit and entry.get('scan_mode') == TREE_SCAN_MODE:
+            self.hits += 1
+            metrics.increment('scan_state.unchanged_branches')
+            return entry
+        self.misses += 1
+        metrics.increment('scan_state.rescanned_branches')
+        return None
+
+    def update_repository(self, repo_path, branches):
+        key = self.repo_key(repo_path)
+        if self.repositories.get(key) != branches:
+            self.repositories[key] = branches
+            self._dirty = True
+
+    def get_repository(self, repo_path):
+        return self.repositories.get(self.repo_key(repo_path))
+
+    def merge_counters(self, hits, misses):
+        self.hits += hits
+        self.misses += misses
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Failed to read scan state {self.path}: {e}. Running a full scan.")
+            return
+
+        if data.get('version') == PARSE_CACHE_VERSION:
+            self.repositories.update(data.get('repositories', {}))
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'version': PARSE_CACHE_VERSION, 'repositories': self.repositories}, file)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
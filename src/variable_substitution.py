@@ -0,0 +1,61 @@
+import re
+from functools import lru_cache
+
+EXPRESSION_PATTERN = re.compile(r'\$\{\{\s*(.*?)\s*\}\}')
+
+
+class VariableIndex:
+    def __init__(self, variables):
+        self.variables = variables
+        self._suffixes = {}
+        self._fallback = {}
+
+        for key in variables:
+            parts = str(key).split('.')
+            for start in range(len(parts)):
+                self._suffixes.setdefault('.'.join(parts[start:]), key)
+
+    def lookup(self, name):
+        # A key whose dotted suffix is exactly the name wins over a key that merely ends with it:
+        # with "env.NODE_VERSION" and "env.VERSION" both defined, "VERSION" is "env.VERSION".
+        key = self._suffixes.get(name)
+        if key is None:
+            # Names that end inside a key segment ("VERSION" for "env.NODE_VERSION") are rare,
+            # so they fall back to a linear scan that is done once per name.
+            if name not in self._fallback:
+                self._fallback[name] = next((key for key in self.variables if str(key).endswith(name)), None)
+            key = self._fallback[name]
+        return None if key is None else self.variables[key]
+
+
+class Template:
+    __slots__ = ('source', 'literals', 'placeholders', 'names')
+
+    def __init__(self, source):
+        self.source = source
+        self.literals = []
+        self.placeholders = []
+
+        position = 0
+        for match in EXPRESSION_PATTERN.finditer(source):
+            self.literals.append(source[position:match.start()])
+            self.placeholders.append((match.group(1), match.group(0)))
+            position = match.end()
+        self.literals.append(source[position:])
+
+        self.names = list(dict.fromkeys(name for name, _ in self.placeholders))
+
+    def render(self, values):
+        if not self.placeholders:
+            return self.source
+
+        parts = [self.literals[0]]
+        for (name, raw), literal in zip(self.placeholders, self.literals[1:]):
+            parts.append(values.get(name, raw))
+            parts.append(literal)
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=4096)
+def compile_template(source):
+    return Template(source)
@@ -0,0 +1,42 @@
+import time
+import traceback
+from .metrics import metrics
+
+DEFAULT_POLL_INTERVAL = 300
+
+
+def run_watch(scan, pipeline, poll_interval=DEFAULT_POLL_INTERVAL, cycles=0):
+    # Repeats scan(on_images) every poll_interval seconds with the same pipeline. The scan state keeps
+    # the last commit of every branch, so only branches that moved are parsed again, and the pipeline
+    # remembers what it has already processed, so only images that were not seen before are pulled,
+    # saved and uploaded. cycles=0 runs until interrupted.
+    cycle = 0
+    images = []
+    try:
+        while True:
+            cycle += 1
+            started = time.monotonic()
+            print(f"Watch cycle {cycle}: scanning repositories...")
+            pipeline.retry_uploads()
+            try:
+                with metrics.timer('watch.cycle'):
+                    images = scan(pipeline.submit)
+                    pipeline.wait()
+            except Exception:
+                # A failed fetch or scan should not stop the daemon; the next cycle tries again.
+                print(f"Watch cycle {cycle} failed:\n{traceback.format_exc()}")
+            if pipeline.save_results or pipeline.upload_results:
+                pipeline.print_summary()
+            else:
+                print("No new images.")
+
+            if cycles and cycle >= cycles:
+                break
+            delay = max(0.0, poll_interval - (time.monotonic() - started))
+            print(f"Watch cycle {cycle} finished, next check in {delay:.0f}s.\n")
+            time.sleep(delay)
+    except KeyboardInterrupt:
+        print("Watch mode interrupted, finishing queued work...")
+    finally:
+        pipeline.stop()
+    return images
@@ -0,0 +1,12 @@
+import yaml
+
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def load_yaml(content, source=None):
+    # Returns every non-empty document of a "---" separated stream, such as a file of Kubernetes manifests.
+    try:
+        return [document for document in yaml.load_all(content, Loader=YAML_LOADER) if document is not None]
+    except yaml.YAMLError as e:
+        print(f"Skipping malformed YAML file {source}: {e}")
+        return []
@@ -0,0 +1,178 @@
+import os
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from .exception import YandexDiskError, TransientYandexDiskError
+from .metrics import metrics
+
+YANDEX_DISK_API_URL = 'https://cloud-api.yandex.net/v1/disk'
+UPLOAD_BLOCK_SIZE = 8 * 1024 * 1024
+DEFAULT_UPLOAD_JOBS = 4
+DEFAULT_UPLOAD_RETRIES = 3
+UPLOAD_RETRY_DELAY = 2
+# 507 (the disk is full) is not retried: it will not go away by waiting.
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class LargeBlockHTTPAdapter(HTTPAdapter):
+    # urllib3 sends file bodies in 16 KB reads by default; multi-GB archives go out in large blocks instead.
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['blocksize'] = UPLOAD_BLOCK_SIZE
+        super().init_poolmanager(*args, **kwargs)
+
+
+class CountingStream:
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self.size += len(chunk)
+            yield chunk
+
+
+def format_throughput(size, seconds):
+    return f"{size / 1024 / 1024:.1f} MB in {seconds:.1f}s ({size / 1024 / 1024 / max(seconds, 1e-6):.1f} MB/s)"
+
+
+class YandexDiskClient:
+    def __init__(self, token, base_url=None, pool_size=DEFAULT_UPLOAD_JOBS, timeout=60):
+        self.base_url = (base_url or get_yandex_disk_api_url()).rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Accept'] = 'application/json'
+        self._auth = {'Authorization': f"OAuth {token}"}
+
+        # The API host and the upload host each get a pool large enough for every upload worker.
+        adapter = LargeBlockHTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def request(self, method, path, params=None):
+        try:
+            return self.session.request(method, f"{self.base_url}{path}", params=params, headers=self._auth,
+                                        timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransientYandexDiskError(f"{method} {path} failed: {e}")
+        except requests.RequestException as e:
+            raise YandexDiskError(f"{method} {path} failed: {e}")
+
+    def check_token(self):
+        try:
+            return self.request('GET', '').status_code == 200
+        except YandexDiskError:
+            return False
+
+    def create_directory(self, directory_path):
+        self.request('PUT', '/resources', {'path': directory_path})
+
+    def list_directory(self, directory_path, page_size=1000):
+        items = []
+        offset = 0
+        while True:
+            params = {
+                'path': directory_path,
+                'fields': '_embedded.items.name,_embedded.items.path,_embedded.total',
+                'limit': page_size,
+                'offset': offset,
+            }
+            response = self.request('GET', '/resources', params)
+            if response.status_code != 200:
+                if response.status_code != 404:
+                    print(f"Failed to list {directory_path} on Yandex.Disk: {response.text}")
+                return items
+
+            embedded = response.json().get('_embedded', {})
+            page = embedded.get('items', [])
+            items.extend(page)
+            offset += len(page)
+            if not page or offset >= embedded.get('total', 0):
+                return items
+
+    def download(self, remote_path):
+        # Returns None only if the file does not exist; any other failure raises YandexDiskError,
+        # so callers never mistake an unreachable file for a missing one.
+        response = self.request('GET', '/resources/download', {'path': remote_path})
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise YandexDiskError(f"Failed to get download URL for {remote_path}: {response.text}")
+
+        try:
+            content_response = self.session.get(response.json()['href'], timeout=self.timeout)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise YandexDiskError(f"Failed to download {remote_path} from Yandex.Disk: {e}")
+        if content_response.status_code != 200:
+            raise YandexDiskError(f"Failed to download {remote_path} from Yandex.Disk: "
+                                  f"{content_response.status_code}")
+        return content_response.content
+
+    def move(self, from_path, to_path):
+        response = self.request('POST', '/resources/move', {'from': from_path, 'path': to_path, 'overwrite': 'true'})
+        if response.status_code in (201, 202):
+            return True
+
+        print(f"Failed to move {from_path} to {to_path} on Yandex.Disk: {response.text}")
+        return False
+
+    def _upload_once(self, data, remote_path, name):
+        response = self.request('GET', '/resources/upload', {'path': remote_path, 'overwrite': 'true'})
+        if response.status_code != 200:
+            error = TransientYandexDiskError if response.status_code in RETRYABLE_STATUS_CODES else YandexDiskError
+            raise error(f"Failed to get upload URL for {name}: {response.text}")
+
+        try:
+            # The upload URL points at another host, so no OAuth header is sent there.
+            upload_response = self.session.put(response.json()['href'], data=data, timeout=self.timeout,
+                                               headers={'Content-Type': 'application/octet-stream'})
+        except requests.RequestException as e:
+            raise TransientYandexDiskError(f"Failed to upload {name} to Yandex.Disk: {e}")
+
+        if upload_response.status_code not in (201, 202):
+            retryable = upload_response.status_code in RETRYABLE_STATUS_CODES
+            error = TransientYandexDiskError if retryable else YandexDiskError
+            raise error(f"Failed to upload {name} to Yandex.Disk: {upload_response.text}")
+
+    def upload(self, open_data, remote_path, name, retries=DEFAULT_UPLOAD_RETRIES, delay=UPLOAD_RETRY_DELAY):
+        # open_data() returns a fresh body for every attempt: Yandex.Disk upload URLs do not accept
+        # ranged uploads, so a dropped connection restarts this file (and only this file) from zero.
+        for attempt in range(retries + 1):
+            print(f"Starting upload of {name} to Yandex.Disk")
+            started = time.monotonic()
+            try:
+                with open_data() as data:
+                    if isinstance(data, bytes):
+                        body, size = data, len(data)
+                    elif hasattr(data, 'read'):
+                        body, size = data, os.fstat(data.fileno()).st_size
+                    else:
+                        body, size = CountingStream(data), None
+                    self._upload_once(body, remote_path, name)
+                    if size is None:
+                        size = body.size
+            except YandexDiskError as e:
+                if attempt == retries or not isinstance(e, TransientYandexDiskError):
+                    print(e)
+                    metrics.increment('upload.failures')
+                    return False
+
+                metrics.increment('upload.retries')
+
+                wait = delay * 2 ** attempt
+                print(f"{e}. Retrying in {wait}s...")
+                time.sleep(wait)
+                continue
+
+            seconds = time.monotonic() - started
+            metrics.add('upload', seconds, size)
+            print(f"Uploaded {name} to Yandex.Disk: {format_throughput(size, seconds)}")
+            return True
+        return False
+
+
+def get_yandex_disk_api_url():
+    return os.environ.get('YANDEX_DISK_API_URL') or YANDEX_DISK_API_URL
@@ -1,147 +1,242 @@
 import os
-import tempfile
-import requests
-import tarfile
-import hashlib
-
-
-def calculate_md5(file_path, extract_path, chunk_size=8192):
+import json
+import threading
+from contextlib import closing, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from .layer_store import is_layer_store, BLOBS_DIRECTORY, IMAGES_DIRECTORY
+from .image_stream import iter_image_archive, NO_COMPRESSION
+from .docker_image_loader import get_image_archive_path, get_image_id
+from .archive_hash import ArchiveHashIndex
+from .exception import YandexDiskError, DockerEngineError
+from .yandex_disk_client import DEFAULT_UPLOAD_JOBS, DEFAULT_UPLOAD_RETRIES
+from .metrics import metrics
+
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+class RemoteManifest:
+    # One JSON file in the remote directory mapping content hash -> archive name, so the remote
+    # index is read with two requests no matter how many archives are stored. Streamed uploads also
+    # record "<image>@<image ID>" -> content hash, since their hash is only known once the upload is done.
+
+    def __init__(self, yandex_disk_directory, client):
+        self.path = f"{yandex_disk_directory}/{MANIFEST_FILE_NAME}"
+        self.directory = yandex_disk_directory
+        self.client = client
+        self.archives = {}
+        self.images = {}
+        self.hashes = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def _download(self):
+        content = self.client.download(self.path)
+        if content is None:
+            return None
+        try:
+            manifest = json.loads(content)
+        except ValueError as e:
+            print(f"Failed to read {self.path}: {e}. It will be rebuilt.")
+            return None
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return manifest
+
+    def load(self):
+        with metrics.timer('upload.manifest_load'):
+            return self._load()
+
+    def _load(self):
+        # Legacy "<archive>.hash" files hold md5 sums, which never match the BLAKE2b content hashes,
+        # so a directory without a manifest starts with an empty one.
+        manifest = self._download()
+        if manifest is None:
+            print(f"No manifest found in {self.directory}. Starting a new one.")
+            manifest = {}
+        archives = manifest.get("archives", {})
+
+        with self._lock:
+            self.archives.update(archives)
+            self.images.update(manifest.get("images", {}))
+            self.hashes.update(archives)
+        print(f"Remote manifest lists {len(self.archives)} archives.")
+        return self
+
+    def contains(self, content_hash):
+        return content_hash in self.hashes
+
+    def contains_image(self, image_key):
+        return self.images.get(image_key) in self.hashes
+
+    def add(self, content_hash, file_name, image_key=None):
+        with self._lock:
+            self.archives[content_hash] = file_name
+            if image_key is not None:
+                self.images[image_key] = content_hash
+            self.hashes.add(content_hash)
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return True
+            # Another run may have written the manifest since it was loaded; keep its entries too.
+            # If it cannot be read, writing now would drop them, so the save is abandoned.
+            try:
+                remote = self._download() or {}
+            except YandexDiskError as e:
+                print(f"Not saving {self.path}: {e}")
+                return False
+            archives = {**remote.get("archives", {}), **self.archives}
+            images = {**remote.get("images", {}), **self.images}
+            data = json.dumps({"version": MANIFEST_VERSION, "archives": archives, "images": images},
+                              indent=1).encode()
+
+            tmp_path = f"{self.path}.tmp"
+            if not self.client.upload(lambda: nullcontext(data), tmp_path, MANIFEST_FILE_NAME):
+                return False
+            if not self.client.move(tmp_path, self.path):
+                return False
+
+            self.archives = archives
+            self.images = images
+            self.hashes = set(archives)
+            self._dirty = False
+            return True
+
+
+def upload_file_to_yandex_disk(file_path, remote_path, client, retries=DEFAULT_UPLOAD_RETRIES):
+    return client.upload(lambda: open(file_path, "rb"), remote_path, os.path.basename(file_path), retries)
+
+
+def upload_files_to_yandex_disk(uploads, client, jobs=DEFAULT_UPLOAD_JOBS, retries=DEFAULT_UPLOAD_RETRIES):
+    # uploads is a list of (local path, remote path); returns the upload result for each of them.
+    def upload(paths):
+        return upload_file_to_yandex_disk(paths[0], paths[1], client, retries)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return list(executor.map(upload, uploads))
+
+
+def upload_image_stream(image, client, yandex_disk_directory, compression=NO_COMPRESSION, compression_level=None,
+                        docker_client=None, manifest=None, retries=DEFAULT_UPLOAD_RETRIES):
+    # The archive is produced from the docker save stream while it is being sent; nothing touches the disk.
+    # A retry exports the image again, since the stream cannot be rewound.
+    file_name = os.path.basename(get_image_archive_path(image, '', compression))
+    archive = {}
+
+    # The content hash is only known after streaming, so an image already uploaded by an earlier run is
+    # recognised by its reference and image ID instead.
+    image_key = None
+    if manifest is not None:
+        try:
+            image_key = f"{image}@{get_image_id(image, docker_client)}"
+        except (DockerEngineError, KeyError) as e:
+            print(f"Failed to resolve the ID of {image}: {e}")
+        if image_key is not None and manifest.contains_image(image_key):
+            print(f"Image {image} already exists on Yandex.Disk. Skipping upload.")
+            metrics.increment('upload.skipped')
+            return True
+
+    def open_stream():
+        return closing(iter_image_archive(image, compression, compression_level, docker_client, archive))
+
+    if not client.upload(open_stream, f"{yandex_disk_directory}/{file_name}", file_name, retries):
+        return False
+
+    if manifest is not None:
+        manifest.add(archive['content_hash'], file_name, image_key)
+    return True
+
+
+def upload_layer_store(directory, client, yandex_disk_directory, jobs=DEFAULT_UPLOAD_JOBS,
+                       retries=DEFAULT_UPLOAD_RETRIES):
+    remote_blobs_directory = f"{yandex_disk_directory}/blobs/sha256"
+    remote_images_directory = f"{yandex_disk_directory}/{IMAGES_DIRECTORY}"
+    for path in (f"{yandex_disk_directory}/blobs", remote_blobs_directory, remote_images_directory):
+        client.create_directory(path)
+
+    # Blobs are named by their digest, so a name already present remotely is the same content.
+    remote_blobs = {item["name"] for item in client.list_directory(remote_blobs_directory)}
+    local_blobs_directory = os.path.join(directory, BLOBS_DIRECTORY)
+    missing = [
+        digest for digest in sorted(os.listdir(local_blobs_directory))
+        if not digest.startswith('.') and digest not in remote_blobs
+    ]
+    print(f"Layer store: {len(missing)} blobs to upload, {len(remote_blobs)} already on Yandex.Disk.")
+
+    results = upload_files_to_yandex_disk(
+        [(os.path.join(local_blobs_directory, digest), f"{remote_blobs_directory}/{digest}") for digest in missing],
+        client, jobs, retries
+    )
+    failed_blobs = {digest for digest, uploaded in zip(missing, results) if not uploaded}
+
+    # Image manifests reference the blobs, so they go up only after every blob upload finished, and a
+    # manifest whose blobs did not all reach Yandex.Disk is held back until a later run uploads them.
+    local_images_directory = os.path.join(directory, IMAGES_DIRECTORY)
+    manifests = []
+    for manifest in sorted(os.listdir(local_images_directory)):
+        if not manifest.endswith('.json'):
+            continue
+        manifest_path = os.path.join(local_images_directory, manifest)
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            digests = {member.get('digest') for member in json.load(file).get('members', [])}
+        if digests & failed_blobs:
+            print(f"Skipping upload of {manifest}: some of its blobs failed to upload.")
+            continue
+        manifests.append((manifest_path, f"{remote_images_directory}/{manifest}"))
+
+    results += upload_files_to_yandex_disk(manifests, client, jobs, retries)
+    return all(results)
+
+
+def upload_archive(file_path, client, yandex_disk_directory, manifest, hash_index, retries=DEFAULT_UPLOAD_RETRIES,
+                   delete_uploaded=False):
+    file_name = os.path.basename(file_path)
     try:
-        with tarfile.open(file_path, "r") as tar:
-            tar.extractall(path=extract_path)
-
-        md5 = hashlib.md5()
-        for root, _, files in os.walk(extract_path):
-            for file in sorted(files):
-                file_path = os.path.join(root, file)
-                with open(file_path, "rb") as f:
-                    while chunk := f.read(chunk_size):
-                        md5.update(chunk)
-    except Exception as e:
-        print(f"Failed to calculate MD5 for {file_path}: {e}")
-        return None
-    return md5.hexdigest()
-
-
-def get_yandex_disk_hash_contents(directory_path, token):
-    url = "https://cloud-api.yandex.net/v1/disk/resources"
-    headers = {
-        "Authorization": f"OAuth {token}",
-        "Accept": "application/json",
-    }
-    params = {
-        "path": directory_path,
-        "fields": "_embedded.items.name,_embedded.items.path",
-        "limit": 10000
-    }
-
-    response = requests.get(url, headers=headers, params=params)
-
-    if response.status_code == 200:
-        items = response.json().get("_embedded", {}).get("items", [])
-        hash_contents = {}
-        for item in items:
-            if item["name"].endswith(".hash"):
-                hash_url = f"https://cloud-api.yandex.net/v1/disk/resources/download?path={item['path']}"
-                hash_response = requests.get(hash_url, headers=headers)
-                if hash_response.status_code == 200:
-                    download_url = hash_response.json()["href"]
-                    content_response = requests.get(download_url)
-                    if content_response.status_code == 200:
-                        hash_contents[item["name"]] = content_response.text.strip()
-        return hash_contents
+        local_hash = hash_index.get_hash(file_path)
+    except (OSError, ValueError, EOFError) as e:
+        print(f"Failed to calculate hash for {file_path}: {e}")
+        return 'hash failed'
+
+    if manifest.contains(local_hash):
+        print(f"File {file_name} already exists on Yandex.Disk. Skipping upload.")
+        metrics.increment('upload.skipped')
+        status = 'skipped'
+    elif upload_file_to_yandex_disk(file_path, f"{yandex_disk_directory}/{file_name}", client, retries):
+        manifest.add(local_hash, file_name)
+        status = 'uploaded'
     else:
-        print(f"Failed to get file info for {directory_path} on Yandex.Disk: {response.text}")
-        return {}
-
-
-def create_yandex_disk_directory(directory_path, token):
-    url = "https://cloud-api.yandex.net/v1/disk/resources"
-    headers = {
-        "Authorization": f"OAuth {token}",
-        "Accept": "application/json",
-    }
-    params = {
-        "path": directory_path,
-    }
-
-    requests.put(url, headers=headers, params=params)
-
-
-def upload_to_yandex_disk(directory, token, yandex_disk_directory):
-    create_yandex_disk_directory(yandex_disk_directory, token)
-
-    url_upload = "https://cloud-api.yandex.net/v1/disk/resources/upload"
-
-    headers = {
-        "Authorization": f"OAuth {token}",
-        "Accept": "application/json",
-    }
-
-    files = [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
-    existing_hashes = get_yandex_disk_hash_contents(yandex_disk_directory, token)
-
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        for file_name in files:
-            file_path = os.path.join(directory, file_name)
-            local_md5 = calculate_md5(file_path, tmpdirname)
-
-            if not local_md5:
-                continue
-
-            hash_file_name = f"{file_name}.hash"
-
-            if local_md5 in existing_hashes.values():
-                print(f"File {file_name} already exists on Yandex.Disk. Skipping upload.")
-                continue
-
-            params = {
-                "path": f"{yandex_disk_directory}/{file_name}",
-                "overwrite": "true",
-            }
-
-            response = requests.get(url_upload, headers=headers, params=params)
-
-            if response.status_code == 200:
-                upload_url = response.json()["href"]
-                print(f"Starting upload of {file_name} to Yandex.Disk")
-
-                with open(file_path, "rb") as file:
-                    upload_response = requests.put(
-                        upload_url,
-                        headers={"Content-Type": "application/octet-stream"},
-                        data=iter(lambda: file.read(4096), b''),
-                        stream=True
-                    )
-
-                    if upload_response.status_code == 201:
-                        print(f"Uploaded {file_name} to Yandex.Disk")
-                    else:
-                        print(f"Failed to upload {file_name} to Yandex.Disk: {upload_response.text}")
-            else:
-                print(f"Failed to get upload URL for {file_name}: {response.text}")
-
-            params_hash = {
-                "path": f"{yandex_disk_directory}/{hash_file_name}",
-                "overwrite": "true",
-            }
-
-            response_hash = requests.get(url_upload, headers=headers, params=params_hash)
-
-            if response_hash.status_code == 200:
-                upload_url_hash = response_hash.json()["href"]
-                print(f"Starting upload of {hash_file_name} to Yandex.Disk")
-
-                upload_response_hash = requests.put(
-                    upload_url_hash,
-                    headers={"Content-Type": "application/octet-stream"},
-                    data=local_md5.encode(),
-                    stream=True
-                )
-
-                if upload_response_hash.status_code == 201:
-                    print(f"Uploaded {hash_file_name} to Yandex.Disk")
-                else:
-                    print(f"Failed to upload {hash_file_name} to Yandex.Disk: {upload_response_hash.text}")
-            else:
-                print(f"Failed to get upload URL for {hash_file_name}: {response_hash.text}")
+        return 'upload failed'
+
+    if delete_uploaded:
+        # The archive is confirmed to be on Yandex.Disk, so the local copy is no longer needed.
+        os.remove(file_path)
+        hash_index.forget(file_path)
+    return status
+
+
+def upload_to_yandex_disk(directory, client, yandex_disk_directory, jobs=DEFAULT_UPLOAD_JOBS,
+                          retries=DEFAULT_UPLOAD_RETRIES, delete_uploaded=False):
+    client.create_directory(yandex_disk_directory)
+
+    files = [
+        f for f in os.listdir(directory)
+        if not f.startswith('.') and os.path.isfile(os.path.join(directory, f))
+    ]
+    manifest = RemoteManifest(yandex_disk_directory, client).load()
+    hash_index = ArchiveHashIndex(directory)
+
+    def upload(file_name):
+        upload_archive(os.path.join(directory, file_name), client, yandex_disk_directory, manifest, hash_index,
+                       retries, delete_uploaded)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        list(executor.map(upload, files))
+
+    manifest.save()
+    hash_index.save()
+
+    if is_layer_store(directory):
+        upload_layer_store(directory, client, yandex_disk_directory, jobs, retries)